@@ -0,0 +1,207 @@
+import os
+import time
+import zlib
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from cache import url_class
+from extractors import parse_product_page, is_complete
+from amazon_config import (
+    NAME,
+    CURRENCY,
+    FILTERS,
+    BASE_URL,
+    ARCHIVE_DIRECTORY,
+    ARCHIVE_SEGMENT_BYTES,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC = "zstd" if zstandard is not None else "zlib"
+# pages handed to one re-parse worker at a time
+CHUNK = 256
+
+
+def compress(data, codec=CODEC):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 9)
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def asin_from_url(url):
+    path = urlsplit(url).path
+    if "/dp/" not in path:
+        return None
+    return path.split("/dp/")[1].split("/")[0]
+
+
+class Archive:
+    """
+    append-only raw html archive: every page is compressed on its own and
+    appended to a daily segment file, an sqlite index maps (asin, fetched_at)
+    to (segment, offset, length) so single pages can be read back directly
+    """
+
+    def __init__(self, directory, segment_bytes=ARCHIVE_SEGMENT_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment = None
+        self.handle = None
+        self.db = sqlite3.connect(os.path.join(directory, "index.db"))
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                asin TEXT,
+                fetched_at REAL NOT NULL,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            )
+            """)
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS pages_asin ON pages (asin, fetched_at)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS pages_fetched ON pages (fetched_at)"
+        )
+        self.db.commit()
+
+    def open_segment(self, fetched_at, size):
+        day = datetime.fromtimestamp(fetched_at).strftime("%Y-%m-%d")
+        if (
+            self.handle is not None
+            and self.segment.startswith(day)
+            and self.handle.tell() + size <= self.segment_bytes
+        ):
+            return
+        if self.handle is not None:
+            self.handle.close()
+        number = len([f for f in os.listdir(self.directory) if f.startswith(day)])
+        self.segment = f"{day}-{number:04d}.seg"
+        self.handle = open(os.path.join(self.directory, self.segment), "ab")
+
+    def add(self, url, content, fetched_at=None):
+        fetched_at = fetched_at or time.time()
+        data = compress(content)
+        self.open_segment(fetched_at, len(data))
+        offset = self.handle.tell()
+        self.handle.write(data)
+        self.handle.flush()
+        self.db.execute(
+            "INSERT INTO pages (url, kind, asin, fetched_at, segment, offset, length, "
+            "codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                url,
+                url_class(url),
+                asin_from_url(url),
+                fetched_at,
+                self.segment,
+                offset,
+                len(data),
+                CODEC,
+            ),
+        )
+        self.db.commit()
+
+    def entries(self, kind="product", since=None, until=None, asin=None):
+        query = "SELECT url, segment, offset, length, codec FROM pages WHERE kind = ?"
+        params = [kind]
+        if since is not None:
+            query += " AND fetched_at >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND fetched_at < ?"
+            params.append(until)
+        if asin is not None:
+            query += " AND asin = ?"
+            params.append(asin)
+        query += " ORDER BY fetched_at"
+        return self.db.execute(query, params).fetchall()
+
+    def read(self, segment, offset, length, codec):
+        return read_page(self.directory, segment, offset, length, codec)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        self.db.close()
+
+
+def read_page(directory, segment, offset, length, codec):
+    with open(os.path.join(directory, segment), "rb") as f:
+        f.seek(offset)
+        return decompress(f.read(length), codec)
+
+
+def reparse_segment(directory, segment, pages):
+    """worker: run the product extractors over pages of one segment"""
+    products = []
+    with open(os.path.join(directory, segment), "rb") as f:
+        for url, offset, length, codec in pages:
+            f.seek(offset)
+            product, _, _, _ = parse_product_page(
+                decompress(f.read(length), codec), url
+            )
+            if is_complete(product):
+                products.append(product)
+    return products
+
+
+def reparse(directory, since=None, until=None, asin=None, workers=None):
+    archive = Archive(directory)
+    segments = {}
+    for url, segment, offset, length, codec in archive.entries(
+        since=since, until=until, asin=asin
+    ):
+        segments.setdefault(segment, []).append((url, offset, length, codec))
+    archive.close()
+    print(f"Re-parsing {sum(map(len, segments.values()))} pages...")
+    latest = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(reparse_segment, directory, segment, pages[i : i + CHUNK])
+            for segment, pages in sorted(segments.items())
+            for i in range(0, len(pages), CHUNK)
+        ]
+        # chunks are submitted in time order, so later fetches overwrite earlier ones
+        for future in futures:
+            for product in future.result():
+                latest[product["asin"]] = product
+    return list(latest.values())
+
+
+if __name__ == "__main__":
+    from scraper_async import GenerateReport, remove_empty_elements
+
+    parser = argparse.ArgumentParser(description="Re-parse archived product pages")
+    parser.add_argument("--date", help="only pages fetched on this day (YYYY-MM-DD)")
+    parser.add_argument("--asin", help="only pages of this ASIN")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--name", default=f"{NAME}-reparsed")
+    args = parser.parse_args()
+
+    since = until = None
+    if args.date:
+        day = datetime.strptime(args.date, "%Y-%m-%d")
+        since = day.timestamp()
+        until = (day + timedelta(days=1)).timestamp()
+    products = reparse(ARCHIVE_DIRECTORY, since, until, args.asin, args.workers)
+    print(f"Got information about {len(products)} products.")
+    data = remove_empty_elements(products)
+    GenerateReport(args.name, FILTERS, BASE_URL, CURRENCY, data)
@@ -0,0 +1,139 @@
+import json
+import asyncio
+import tomllib
+import argparse
+import logging
+from scraper_async import AmazonAPI, CrawlContext
+from logs import setup_logging
+from report import (
+    StreamingReport,
+    GenerateReport,
+    remove_empty_elements,
+    query_name,
+)
+from amazon_config import (
+    DIRECTORY,
+    CURRENCY,
+    BASE_URL,
+    REPORT_FORMAT,
+    BATCH_CONCURRENCY,
+)
+
+logger = logging.getLogger("batch")
+
+
+def load_watchlist(path):
+    """
+    read (term, min, max, currency) queries from a toml file with
+    [[queries]] tables or a json file holding a list / {"queries": [...]}
+    """
+    with open(path, "rb") as f:
+        data = tomllib.load(f) if path.endswith(".toml") else json.load(f)
+    if isinstance(data, dict):
+        data = data["queries"]
+    return [
+        {
+            "term": query["term"],
+            "filters": {"min": str(query["min"]), "max": str(query["max"])},
+            "currency": query.get("currency", CURRENCY),
+        }
+        for query in data
+    ]
+
+
+async def run_watchlist(queries, name, resume=False):
+    context = CrawlContext(name)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_query(query):
+        async with semaphore:
+            api = AmazonAPI(
+                query["term"],
+                query["filters"],
+                BASE_URL,
+                query["currency"],
+                context,
+                name=query_name(query["term"], query["filters"]),
+            )
+            return await api.run(resume=resume)
+
+    try:
+        return await asyncio.gather(*(run_query(query) for query in queries))
+    finally:
+        await context.close()
+
+
+def combined_filters(queries):
+    return {
+        query_name(query["term"], query["filters"]): query["filters"]
+        for query in queries
+    }
+
+
+def combined_currency(queries):
+    return ", ".join(sorted({query["currency"] for query in queries}))
+
+
+def write_reports(name, queries, results):
+    combined = {}
+    for query, products in zip(queries, results):
+        data = remove_empty_elements(products or [])
+        GenerateReport(
+            query_name(query["term"], query["filters"]),
+            query["filters"],
+            BASE_URL,
+            query["currency"],
+            data,
+            search_term=query["term"],
+        )
+        for product in data:
+            combined.setdefault(product["asin"], product)
+    GenerateReport(
+        name,
+        combined_filters(queries),
+        BASE_URL,
+        combined_currency(queries),
+        list(combined.values()),
+        snapshot=False,
+    )
+
+
+def combine_streams(name, queries):
+    """merge the per-query ndjson reports into one, each ASIN once"""
+    report = StreamingReport(
+        name,
+        combined_filters(queries),
+        BASE_URL,
+        combined_currency(queries),
+        snapshot=False,
+    )
+    seen = set()
+    for query in queries:
+        with open(
+            f"{DIRECTORY}/{query_name(query['term'], query['filters'])}.ndjson"
+        ) as f:
+            for line in f:
+                product = json.loads(line)
+                if product["asin"] not in seen:
+                    seen.add(product["asin"])
+                    report.add(product)
+    report.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape every query of a watchlist")
+    parser.add_argument("watchlist", help="watchlist .toml or .json file")
+    parser.add_argument("--name", default="watchlist", help="combined report name")
+    parser.add_argument(
+        "--resume", action="store_true", help="pick up an interrupted batch"
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+    queries = load_watchlist(args.watchlist)
+    logger.info(f"Running {len(queries)} queries...")
+    results = asyncio.run(run_watchlist(queries, args.name, args.resume))
+    if REPORT_FORMAT == "ndjson":
+        combine_streams(args.name, queries)
+    else:
+        write_reports(args.name, queries, results)
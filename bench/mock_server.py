@@ -0,0 +1,293 @@
+import os
+import math
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CAPTCHA_PAGE = (
+    "<html><body><form action='/errors/validateCaptcha'>"
+    "<h4>Enter the characters you see below</h4></form></body></html>"
+)
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+def make_padding(size):
+    """unrelated markup of roughly `size` bytes, so pages parse like real ones"""
+    rows = []
+    total = 0
+    n = 0
+    while total < size:
+        row = (
+            f"<div class='a-section a-spacing-small row-{n}'><span class='a-size-base'>"
+            f"item {n}</span><a class='a-link-normal' href='/x/{n}'>link {n}</a>"
+            f"<ul class='a-unordered-list'><li><span>a</span></li><li><span>b</span>"
+            f"</li></ul></div>"
+        )
+        rows.append(row)
+        total += len(row)
+        n += 1
+    return "\n".join(rows)
+
+
+class MockAmazon:
+    """
+    serves search result and product pages built from the fixtures, with
+    configurable latency and injected 500s, 503 throttling and captchas
+    """
+
+    def __init__(
+        self,
+        products=200,
+        cards_per_page=20,
+        latency=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        captcha_rate=0.0,
+        padding=300_000,
+        seed=0,
+    ):
+        self.asins = [f"B{n:09d}" for n in range(products)]
+        self.cards_per_page = cards_per_page
+        self.pages = math.ceil(products / cards_per_page)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.captcha_rate = captcha_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.status_counts = {}
+        self.search_template = load_fixture("search.html")
+        self.card_template = load_fixture("search_card.html")
+        self.product_template = load_fixture("product.html")
+        self.search_padding = make_padding(padding // 2)
+        self.product_padding = make_padding(padding)
+        self.server = None
+
+    @staticmethod
+    def product(asin):
+        rng = random.Random(asin)
+        price = rng.randint(10000, 99999) / 100
+        return {
+            "asin": asin,
+            "title": f"Mock Product {asin} with a reasonably long marketing title",
+            "price": f"{price:.2f}",
+            "price_whole": str(int(price)),
+            "price_fraction": f"{price:.2f}".split(".")[1],
+            "rating": f"{rng.randint(30, 50) / 10:.1f}",
+            "review_count": f"{rng.randint(1, 20000):,}",
+            "seller": rng.choice(["Samsung", "Sony", "WD", "Seagate"]),
+        }
+
+    def search_page(self, term, page):
+        start = (page - 1) * self.cards_per_page
+        asins = self.asins[start : start + self.cards_per_page]
+        cards = "\n".join(
+            self.card_template.format(index=i, **self.product(asin))
+            for i, asin in enumerate(asins)
+        )
+        pagination = ""
+        if page < self.pages:
+            pagination = (
+                f"<a class='s-pagination-item s-pagination-next' "
+                f"href='/s?k={term}&page={page + 1}'>Next</a>"
+            )
+        return self.search_template.format(
+            term=term, cards=cards, pagination=pagination, padding=self.search_padding
+        )
+
+    def product_page(self, asin):
+        if asin not in self.asins:
+            return None
+        return self.product_template.format(
+            padding=self.product_padding, **self.product(asin)
+        )
+
+    def respond(self, path, query):
+        """(status, body) for a request; injects failures before routing"""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            return 503, "<html><body>Service Unavailable</body></html>"
+        roll -= self.throttle_rate
+        if roll < self.captcha_rate:
+            return 200, CAPTCHA_PAGE
+        roll -= self.captcha_rate
+        if roll < self.error_rate:
+            return 500, "<html><body>Internal Server Error</body></html>"
+        if path == "/s":
+            term = query.get("k", [""])[0]
+            page = int(query.get("page", ["1"])[0])
+            return 200, self.search_page(term, page)
+        if path.startswith("/dp/"):
+            body = self.product_page(path.split("/")[2])
+            if body is not None:
+                return 200, body
+        return 404, "<html><body>Not Found</body></html>"
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if mock.latency:
+                    time.sleep(mock.latency)
+                parts = urlsplit(self.path)
+                status, body = mock.respond(parts.path, parse_qs(parts.query))
+                with mock.lock:
+                    mock.status_counts[status] = mock.status_counts.get(status, 0) + 1
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html;charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MockProxy:
+    """
+    a forward http proxy standing in for a real one: relays absolute-uri GETs
+    with its own added latency, and answers a share of them with a 403 block
+    page as a burned proxy would
+    """
+
+    def __init__(self, latency=0.0, block_rate=0.0, seed=0):
+        self.latency = latency
+        self.block_rate = block_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.blocked = 0
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        self.server = None
+
+    def forward(self, url, headers):
+        with self.lock:
+            self.requests += 1
+            blocked = self.random.random() < self.block_rate
+            self.blocked += blocked
+        if blocked:
+            return 403, b"<html><body>Access denied</body></html>"
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if proxy.latency:
+                    time.sleep(proxy.latency)
+                headers = {
+                    key: value
+                    for key, value in self.headers.items()
+                    if key.lower() not in ("host", "proxy-connection", "connection")
+                }
+                status, data = proxy.forward(self.path, headers)
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html;charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server_url
+
+    @property
+    def server_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_proxies(spec, seed=0):
+    """`latency:block_rate,...` -> running MockProxy instances"""
+    proxies = []
+    for i, item in enumerate(filter(None, spec.split(","))):
+        latency, _, block_rate = item.partition(":")
+        proxy = MockProxy(float(latency), float(block_rate or 0), seed + i)
+        proxy.start()
+        proxies.append(proxy)
+    return proxies
+
+
+def add_arguments(parser):
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--cards-per-page", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--captcha-rate", type=float, default=0.0)
+    parser.add_argument("--padding", type=int, default=300_000, help="bytes")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def from_arguments(args):
+    return MockAmazon(
+        products=args.products,
+        cards_per_page=args.cards_per_page,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        captcha_rate=args.captcha_rate,
+        padding=args.padding,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve mock amazon pages")
+    parser.add_argument("--port", type=int, default=8000)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = from_arguments(args)
+    port = mock.start(args.port)
+    print(f"Serving mock amazon on http://127.0.0.1:{port}/s?k=ps5")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_server import add_arguments, from_arguments, start_proxies  # noqa: E402
+
+SCRAPERS = ("sync", "async")
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {
+        "mean": statistics.fmean(values),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": values[-1],
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux; children covers the parser pool
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": own / 1024, "children": children / 1024}
+
+
+def bench_parse(mock, rounds):
+    """time parse_product_page on a fixture product page for every backend"""
+    import parsers
+    from extractors import PageQuery, extract_product
+
+    asin = mock.asins[0]
+    content = mock.product_page(asin).encode()
+    url = f"https://www.amazon.com/dp/{asin}"
+    results = {"page_bytes": len(content)}
+    for backend in parsers.BACKENDS:
+        if not parsers.available(backend):
+            continue
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            page = PageQuery(parsers.parse_document(content, url, backend))
+            extract_product(page, url)
+            timings.append(time.perf_counter() - started)
+        results[backend] = percentiles(timings)
+    return results
+
+
+def configure(port, args, directory):
+    """point the scrapers at the mock server before they import amazon_config"""
+    import amazon_config
+
+    amazon_config.BASE_URL = f"http://127.0.0.1:{port}/s?k="
+    amazon_config.PRODUCT_URL = f"http://127.0.0.1:{port}/dp/"
+    amazon_config.DIRECTORY = directory
+    amazon_config.MAX_PAGES = 1000
+    amazon_config.REQUESTS_PER_SECOND = args.rate
+    amazon_config.BURST = args.rate
+    amazon_config.MAX_CONCURRENCY = args.concurrency
+    amazon_config.RENDER = "never"
+    amazon_config.CACHE_MODE = "off"
+    amazon_config.ARCHIVE = False
+    amazon_config.STORE = False
+    amazon_config.JOURNAL = False
+    amazon_config.SEARCH_CARD_ONLY = False
+    amazon_config.REPORT_FORMAT = "json"
+    amazon_config.PROXIES = list(filter(None, args.proxy_urls.split(",")))
+
+
+def run_child(scraper, port, args):
+    """one crawl of the mock server; runs in its own process so rss is its own"""
+    directory = tempfile.mkdtemp()
+    configure(port, args, directory)
+    latencies = []
+
+    # both scrapers run the async engine; wrap it to time each product
+    import scraper_async
+
+    parse_new_card = scraper_async.AmazonAPI.parse_new_card
+
+    async def timed(self, card):
+        started = time.perf_counter()
+        try:
+            return await parse_new_card(self, card)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    scraper_async.AmazonAPI.parse_new_card = timed
+    filters = {"min": "1", "max": "2"}
+    base_url = f"http://127.0.0.1:{port}/s?k="
+
+    if scraper == "sync":
+        import scraper
+
+        started = time.perf_counter()
+        api = scraper.AmazonAPI("ps5", filters, base_url, "$")
+        products = api.run() or []
+    else:
+        import asyncio
+
+        async def crawl():
+            api = scraper_async.AmazonAPI("ps5", filters, base_url, "$")
+            return api, await api.run()
+
+        started = time.perf_counter()
+        api, products = asyncio.run(crawl())
+        products = products or []
+    elapsed = time.perf_counter() - started
+    parsed = len([p for p in products if p])
+    return {
+        "wall_seconds": elapsed,
+        "products": parsed,
+        "products_per_second": parsed / elapsed if elapsed else 0,
+        "product_latency": percentiles(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+        "metrics": api.metrics.summary(),
+    }
+
+
+def bench_crawl(scraper, port, args):
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--child",
+            scraper,
+            "--port",
+            str(port),
+            "--rate",
+            str(args.rate),
+            "--concurrency",
+            str(args.concurrency),
+            "--output",
+            output.name,
+            "--proxy-urls",
+            args.proxy_urls,
+        ]
+        completed = subprocess.run(
+            command,
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if completed.returncode != 0:
+            return {"error": completed.stderr.strip().splitlines()[-1:]}
+        with open(output.name) as f:
+            return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the crawl pipeline")
+    add_arguments(parser)
+    parser.add_argument("--scrapers", default=",".join(SCRAPERS))
+    parser.add_argument("--rate", type=float, default=1000, help="requests/second")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--parse-rounds", type=int, default=20)
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--child", choices=SCRAPERS, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--proxies",
+        default="",
+        help="local stand-in proxies as latency:block_rate,... (default: direct)",
+    )
+    parser.add_argument("--proxy-urls", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_child(args.child, args.port, args)
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+        sys.exit(0)
+
+    mock = from_arguments(args)
+    port = mock.start()
+    proxies = start_proxies(args.proxies, args.seed)
+    args.proxy_urls = ",".join(proxy.server_url for proxy in proxies)
+    results = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            k: v
+            for k, v in vars(args).items()
+            if k not in ("child", "port", "output", "proxy_urls")
+        },
+        "parse": bench_parse(mock, args.parse_rounds),
+        "crawl": {},
+    }
+    for scraper in args.scrapers.split(","):
+        print(f"Benchmarking {scraper}...", file=sys.stderr)
+        results["crawl"][scraper] = bench_crawl(scraper, port, args)
+    results["server"] = {"status_counts": mock.status_counts}
+    if proxies:
+        results["proxies"] = {
+            proxy.server_url: {"requests": proxy.requests, "blocked": proxy.blocked}
+            for proxy in proxies
+        }
+    for proxy in proxies:
+        proxy.stop()
+    mock.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,198 @@
+import os
+import time
+import zlib
+import asyncio
+import sqlite3
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests_html import HTML
+
+# query parameters amazon adds for tracking; they never change the page
+TRACKING_PARAMS = ("ref", "ref_", "qid", "sr", "crid", "sprefix")
+
+
+def normalize_url(url):
+    parts = urlsplit(url)
+    path = parts.path
+    if "/dp/" in path:
+        # /Some-Title/dp/B09JHKSNNG/ref=sr_1_1 -> /dp/B09JHKSNNG
+        path = "/dp/" + path.split("/dp/")[1].split("/")[0]
+    query = sorted(
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS
+    )
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), "")
+    )
+
+
+def url_class(url):
+    path = urlsplit(url).path
+    if "/dp/" in path:
+        return "product"
+    if path == "/s" or path.startswith("/s/"):
+        return "search"
+    return "other"
+
+
+class SingleFlight:
+    """
+    concurrent calls for the same key share one running call: the first
+    caller starts it, later callers await the same future until it is done
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    def pending(self, key):
+        return key in self.calls
+
+    async def do(self, key, call, *args):
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(call(*args))
+            self.calls[key] = future
+            future.add_done_callback(lambda _: self.calls.pop(key, None))
+        # one caller giving up must not cancel the call for the others
+        return await asyncio.shield(future)
+
+
+class CachedResponse:
+    """the parts of a requests_html response the scrapers use"""
+
+    def __init__(self, url, status_code, content, headers=None, from_cache=True):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.from_cache = from_cache
+        self._html = None
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._html = HTML(url=self.url, html=self.text)
+        return self._html
+
+
+class CacheEntry:
+    def __init__(self, key, status_code, body, etag, last_modified, fetched_at):
+        self.key = key
+        self.status_code = status_code
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.fetched_at < ttl
+
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def response(self, url):
+        return CachedResponse(url, self.status_code, zlib.decompress(self.body))
+
+
+class ResponseCache:
+    """
+    persistent response cache: zlib-compressed bodies in sqlite, keyed by
+    normalized url, with per-url-class ttls and lru eviction past `max_bytes`
+    """
+
+    def __init__(self, directory, ttls, max_bytes):
+        os.makedirs(directory, exist_ok=True)
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(os.path.join(directory, "responses.db"))
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status_code INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """)
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+        )
+        self.db.commit()
+
+    def ttl(self, url):
+        return self.ttls.get(url_class(url), self.ttls["other"])
+
+    def get(self, url):
+        key = normalize_url(url)
+        row = self.db.execute(
+            "SELECT status_code, body, etag, last_modified, fetched_at "
+            "FROM responses WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.execute(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        self.db.commit()
+        return CacheEntry(key, *row)
+
+    def put(self, url, response):
+        body = zlib.compress(response.content)
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                normalize_url(url),
+                response.status_code,
+                body,
+                len(body),
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                now,
+                now,
+            ),
+        )
+        self.evict()
+        self.db.commit()
+
+    def revalidated(self, entry):
+        """a 304 answer makes the stored body fresh again"""
+        entry.fetched_at = time.time()
+        self.db.execute(
+            "UPDATE responses SET fetched_at = ? WHERE key = ?",
+            (entry.fetched_at, entry.key),
+        )
+        self.db.commit()
+
+    def evict(self):
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+        self.db.close()
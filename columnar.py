@@ -0,0 +1,308 @@
+import os
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from amazon_config import (
+    COLUMNAR,
+    COLUMNAR_DIRECTORY,
+    STORE_PATH,
+    ANALYTICS_TOP_K,
+    PRICE_DROP_THRESHOLD,
+)
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.json as pj
+except ImportError:
+    pa = None
+
+# rows read from sqlite per parquet batch in `export_store`
+EXPORT_BATCH = 100_000
+PRODUCT_COLUMNS = (
+    "asin",
+    "price",
+    "rating",
+    "review_count",
+    "title",
+    "seller",
+    "url",
+    "photo_url",
+)
+
+
+def available():
+    return pa is not None
+
+
+def schema():
+    return pa.schema(
+        [
+            ("asin", pa.string()),
+            ("search_term", pa.string()),
+            ("observed_at", pa.float64()),
+            ("price", pa.float64()),
+            ("rating", pa.float64()),
+            ("review_count", pa.int64()),
+            ("title", pa.string()),
+            ("seller", pa.string()),
+            ("url", pa.string()),
+            ("photo_url", pa.string()),
+        ]
+    )
+
+
+def product_table(products, search_term, observed_at=None):
+    """list of product dicts -> observations table of one snapshot"""
+    observed_at = observed_at or time.time()
+    rows = [
+        {**product, "search_term": search_term, "observed_at": observed_at}
+        for product in products
+        if product
+    ]
+    return pa.Table.from_pylist(rows, schema=schema())
+
+
+def read_ndjson(path, search_term, observed_at=None):
+    """a streamed `.ndjson` report -> observations table, without a python loop"""
+    fields = [field for field in schema() if field.name in PRODUCT_COLUMNS]
+    table = pj.read_json(
+        path,
+        parse_options=pj.ParseOptions(
+            explicit_schema=pa.schema(fields), unexpected_field_behavior="ignore"
+        ),
+    )
+    n = table.num_rows
+    table = table.append_column("search_term", pa.array([search_term] * n, pa.string()))
+    table = table.append_column(
+        "observed_at", pa.array([observed_at or time.time()] * n, pa.float64())
+    )
+    return table.select(schema().names).cast(schema())
+
+
+def with_date(table):
+    dates = pc.strftime(
+        pc.cast(pc.floor(table["observed_at"]).cast(pa.int64()), pa.timestamp("s")),
+        format="%Y-%m-%d",
+    )
+    return table.append_column("date", dates)
+
+
+def write_snapshot(table, directory=COLUMNAR_DIRECTORY):
+    """
+    append a table to the parquet dataset at `directory/observations`,
+    hive-partitioned as search_term=.../date=.../
+    """
+    if not table.num_rows:
+        return
+    ds.write_dataset(
+        with_date(table),
+        os.path.join(directory, "observations"),
+        format="parquet",
+        partitioning=["search_term", "date"],
+        partitioning_flavor="hive",
+        basename_template=f"run-{time.time_ns()}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def dataset(directory=COLUMNAR_DIRECTORY):
+    path = os.path.join(directory, "observations")
+    if not os.path.isdir(path):
+        return None
+    return ds.dataset(path, format="parquet", partitioning="hive")
+
+
+def previous_snapshot(
+    search_term, before, columns=("asin", "observed_at", "price"), directory=None
+):
+    """the latest observation of every ASIN of `search_term` made before `before`"""
+    data = dataset(directory or COLUMNAR_DIRECTORY)
+    if data is None:
+        return None
+    table = data.to_table(
+        columns=list(columns) if columns else None,
+        filter=(ds.field("search_term") == search_term)
+        & (ds.field("observed_at") < before),
+    )
+    if not table.num_rows:
+        return None
+    latest = table.group_by("asin").aggregate([("observed_at", "max")])
+    latest = latest.rename_columns(["asin", "observed_at"])
+    return table.join(latest, ["asin", "observed_at"], join_type="inner")
+
+
+def price_stats(table):
+    prices = table["price"].to_numpy(zero_copy_only=False).astype(float)
+    prices = prices[~np.isnan(prices)]
+    if not prices.size:
+        return None
+    p10, p25, median, p75, p90 = np.percentile(prices, [10, 25, 50, 75, 90])
+    return {
+        "count": int(prices.size),
+        "min": float(prices.min()),
+        "p10": round(float(p10), 2),
+        "p25": round(float(p25), 2),
+        "median": round(float(median), 2),
+        "p75": round(float(p75), 2),
+        "p90": round(float(p90), 2),
+        "max": float(prices.max()),
+        "mean": round(float(prices.mean()), 2),
+    }
+
+
+def top_rated(table, k=ANALYTICS_TOP_K):
+    """
+    top k by rating weighted by review count: a bayesian average that pulls
+    ratings with few reviews towards the mean rating, with the median
+    review count as the weight of the prior
+    """
+    ratings = table["rating"].to_numpy(zero_copy_only=False).astype(float)
+    reviews = table["review_count"].to_numpy(zero_copy_only=False).astype(float)
+    known = ~np.isnan(ratings)
+    if not known.any():
+        return []
+    reviews = np.nan_to_num(reviews)
+    mean_rating = ratings[known].mean()
+    prior = max(np.median(reviews[known]), 1.0)
+    scores = (reviews * ratings + prior * mean_rating) / (reviews + prior)
+    scores[~known] = -np.inf
+    k = min(k, int(known.sum()))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    rows = table.take(pa.array(top)).select(list(PRODUCT_COLUMNS)).to_pylist()
+    for row, index in zip(rows, top):
+        row["score"] = round(float(scores[index]), 4)
+    return rows
+
+
+def price_drops(table, previous, threshold=PRICE_DROP_THRESHOLD):
+    """products whose price fell by at least `threshold` since `previous`"""
+    if previous is None:
+        return []
+    previous = previous.select(["asin", "price"]).rename_columns(
+        ["asin", "previous_price"]
+    )
+    joined = table.select(["asin", "title", "url", "price"]).join(
+        previous, "asin", join_type="inner"
+    )
+    if not joined.num_rows:
+        return []
+    drop = pc.divide(
+        pc.subtract(joined["previous_price"], joined["price"]),
+        joined["previous_price"],
+    )
+    joined = joined.append_column("drop", drop)
+    joined = joined.filter(pc.greater_equal(joined["drop"], threshold))
+    joined = joined.sort_by([("drop", "descending")])
+    rows = joined.to_pylist()
+    for row in rows:
+        row["drop"] = round(row["drop"], 4)
+    return rows
+
+
+def analyze(table, previous=None):
+    return {
+        "price": price_stats(table),
+        "top_rated": top_rated(table),
+        "price_drops": price_drops(table, previous),
+    }
+
+
+def snapshot_analytics(table, search_term, snapshot=True):
+    """
+    analytics of a finished report; with COLUMNAR on, price drops are found
+    against the previous snapshot of `search_term` and this run is saved as
+    the next one
+    """
+    previous = None
+    if COLUMNAR:
+        before = pc.min(table["observed_at"]).as_py() if table.num_rows else None
+        if before is not None:
+            previous = previous_snapshot(search_term, before)
+    analytics = analyze(table, previous)
+    if COLUMNAR and snapshot:
+        write_snapshot(table)
+    return analytics
+
+
+def export_store(path=STORE_PATH, directory=COLUMNAR_DIRECTORY):
+    """
+    rebuild the parquet partitions from the sqlite price history; partitions
+    present in the store are replaced, others are left alone
+    """
+    names = schema().names
+
+    def batches():
+        # pyarrow pulls batches from its own thread, so the connection lives here
+        db = sqlite3.connect(path)
+        cursor = db.execute("""
+            SELECT o.asin, o.search_term, o.observed_at, o.price, o.rating,
+                   o.review_count, p.title, p.seller, p.url, p.photo_url
+            FROM observations o
+            JOIN products p ON p.asin = o.asin
+            ORDER BY o.search_term, o.observed_at
+            """)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH)
+            if not rows:
+                db.close()
+                return
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays(
+                [
+                    pa.array(column, field.type)
+                    for column, field in zip(columns, schema())
+                ],
+                names=names,
+            )
+            yield from with_date(table).to_batches()
+
+    output_schema = schema().append(pa.field("date", pa.string()))
+    ds.write_dataset(
+        ds.Scanner.from_batches(batches(), schema=output_schema),
+        os.path.join(directory, "observations"),
+        format="parquet",
+        partitioning=["search_term", "date"],
+        partitioning_flavor="hive",
+        basename_template="store-{i}.parquet",
+        existing_data_behavior="delete_matching",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar export and analytics")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("export", help="write the sqlite price history to parquet")
+    analyze_parser = commands.add_parser(
+        "analyze", help="analytics of the latest snapshot of a search term"
+    )
+    analyze_parser.add_argument("search_term")
+    args = parser.parse_args()
+
+    if not available():
+        raise SystemExit("pyarrow and numpy are needed: pip install pyarrow numpy")
+    if args.command == "export":
+        export_store()
+        print(f"Exported the price history to {COLUMNAR_DIRECTORY}/observations")
+    else:
+        table = previous_snapshot(args.search_term, time.time(), columns=None)
+        if table is None:
+            raise SystemExit(f"No snapshots of {args.search_term}")
+        before = pc.min(table["observed_at"]).as_py()
+        analytics = analyze(table, previous_snapshot(args.search_term, before))
+        print(
+            f"{datetime.fromtimestamp(before):%d/%m/%Y %H:%M:%S}: "
+            f"{table.num_rows} products"
+        )
+        print(f"price: {analytics['price']}")
+        for row in analytics["top_rated"]:
+            print(f"top  {row['score']:.2f}  {row['asin']}  {row['title']}")
+        for row in analytics["price_drops"]:
+            print(
+                f"drop {row['drop']:.0%}  {row['previous_price']} -> {row['price']}  "
+                f"{row['asin']}  {row['title']}"
+            )
@@ -0,0 +1,413 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from throttle import backoff_delay
+from logs import setup_logging
+from batch import load_watchlist
+from report import GenerateReport, remove_empty_elements, query_name
+from scraper_async import AmazonAPI, CrawlContext, FetchError
+from amazon_config import (
+    BASE_URL,
+    MAX_PAGES,
+    MAX_CONCURRENCY,
+    REQUESTS_PER_SECOND,
+    BROKER_URL,
+    LEASE_SECONDS,
+    MAX_ATTEMPTS,
+)
+
+logger = logging.getLogger("distributed")
+
+# seconds an idle worker waits before asking the broker again
+POLL_INTERVAL = 1.0
+
+
+class Task:
+    def __init__(self, id, kind, key, payload, attempts):
+        self.id = id
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+
+
+class SqliteBroker:
+    """
+    durable work queue and result sink in one sqlite file that every worker
+    on the machine (or on a shared volume) opens. A leased task is invisible
+    to other workers until its lease runs out, so a crashed worker's tasks
+    are picked up again; tasks are deduplicated by key.
+    """
+
+    def __init__(self, path):
+        # workers call in from one dedicated thread, not the one that opened it
+        self.db = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                worker TEXT,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS tasks_ready
+                ON tasks (state, priority, available_at);
+            CREATE TABLE IF NOT EXISTS results (
+                query TEXT NOT NULL,
+                asin TEXT NOT NULL,
+                product TEXT,
+                worker TEXT,
+                finished_at REAL NOT NULL,
+                PRIMARY KEY (query, asin)
+            );
+            """)
+
+    def put(self, kind, key, payload, priority=0):
+        """queue a task unless one with the same key exists; True when queued"""
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO tasks (kind, key, payload, priority, available_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (kind, key, json.dumps(payload), priority, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def lease(self, worker, seconds=LEASE_SECONDS):
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # a task whose workers keep dying with it is given up like any other
+            self.db.execute(
+                "UPDATE tasks SET state = 'failed', lease_until = NULL, "
+                "error = 'lease expired' "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            row = self.db.execute(
+                """
+                UPDATE tasks
+                SET state = 'leased', lease_until = ?, worker = ?,
+                    attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM tasks
+                    WHERE (state = 'pending' AND available_at <= ?)
+                       OR (state = 'leased' AND lease_until < ? AND attempts < ?)
+                    ORDER BY priority, id
+                    LIMIT 1
+                )
+                RETURNING id, kind, key, payload, attempts
+                """,
+                (now + seconds, worker, now, now, MAX_ATTEMPTS),
+            ).fetchone()
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return Task(
+            row["id"],
+            row["kind"],
+            row["key"],
+            json.loads(row["payload"]),
+            row["attempts"],
+        )
+
+    def ack(self, task, worker):
+        self.db.execute(
+            "UPDATE tasks SET state = 'done', lease_until = NULL "
+            "WHERE id = ? AND worker = ?",
+            (task.id, worker),
+        )
+
+    def nack(self, task, worker, error, delay):
+        """hand a failed task back after `delay` seconds, or drop it for good"""
+        state = "failed" if task.attempts >= MAX_ATTEMPTS else "pending"
+        self.db.execute(
+            "UPDATE tasks SET state = ?, available_at = ?, lease_until = NULL, "
+            "error = ? WHERE id = ? AND worker = ?",
+            (state, time.time() + delay, error, task.id, worker),
+        )
+
+    def add_result(self, query, asin, product, worker):
+        """`query` is the query_key of the query the product was found by"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (query, asin, json.dumps(product), worker, time.time()),
+        )
+
+    def results(self, query):
+        rows = self.db.execute(
+            "SELECT product FROM results WHERE query = ? ORDER BY finished_at",
+            (query,),
+        ).fetchall()
+        return [json.loads(row["product"]) for row in rows]
+
+    def counts(self):
+        rows = self.db.execute(
+            "SELECT kind, state, COUNT(*) AS n FROM tasks GROUP BY kind, state"
+        ).fetchall()
+        return {f"{row['kind']}/{row['state']}": row["n"] for row in rows}
+
+    def idle(self):
+        """nothing left that any worker could still take or finish"""
+        (n,) = self.db.execute(
+            "SELECT COUNT(*) FROM tasks WHERE state IN ('pending', 'leased')"
+        ).fetchone()
+        return n == 0
+
+    def reset(self):
+        """forget every task and result, to crawl the same queries again"""
+        self.db.execute("DELETE FROM tasks")
+        self.db.execute("DELETE FROM results")
+
+    def close(self):
+        self.db.close()
+
+
+BROKERS = {"sqlite": SqliteBroker}
+
+
+def make_broker(url=BROKER_URL):
+    """`sqlite:///relative.db` or `sqlite:////absolute/path.db`"""
+    scheme, _, location = url.partition("://")
+    if scheme not in BROKERS:
+        raise ValueError(f"Unknown broker {scheme!r}, expected one of {list(BROKERS)}")
+    return BROKERS[scheme](location[1:] if location.startswith("/") else location)
+
+
+def query_key(query):
+    return f"{query['term']}|{query['filters']['min']}-{query['filters']['max']}"
+
+
+def submit(broker, queries):
+    """queue the first search page of every query"""
+    for query in queries:
+        broker.put("search", f"search|{query_key(query)}|1", {**query, "page": 1})
+
+
+class Worker:
+    """
+    pulls tasks from the broker with `concurrency` coroutines sharing one
+    crawl context, so each worker has its own rate budget and connections.
+    Broker calls can wait on other processes for the database lock, so they
+    run one at a time on a thread of their own, off the event loop.
+    """
+
+    def __init__(self, broker, name, concurrency, requests_per_second):
+        self.broker = broker
+        self.name = name
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.context = None
+        self.apis = {}
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="broker")
+
+    async def call(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, method, *args)
+
+    async def run(self, exit_when_idle=False):
+        self.context = CrawlContext(self.name, self.requests_per_second)
+        try:
+            await asyncio.gather(
+                *(self.loop(exit_when_idle) for _ in range(self.concurrency))
+            )
+        finally:
+            await self.context.close()
+            self.executor.shutdown()
+
+    def api(self, query):
+        key = query_key(query)
+        if key not in self.apis:
+            self.apis[key] = AmazonAPI(
+                query["term"],
+                query["filters"],
+                BASE_URL,
+                query["currency"],
+                self.context,
+            )
+        return self.apis[key]
+
+    async def loop(self, exit_when_idle):
+        while True:
+            task = await self.call(self.broker.lease, self.name)
+            if task is None:
+                if exit_when_idle and await self.call(self.broker.idle):
+                    return
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            try:
+                if task.kind == "search":
+                    await self.search(task)
+                else:
+                    await self.product(task)
+            except Exception as e:
+                delay = backoff_delay(task.attempts, cap=LEASE_SECONDS)
+                logger.warning(
+                    "Task failed",
+                    extra={
+                        "fields": {
+                            "task": task.key,
+                            "attempts": task.attempts,
+                            "retry_in": round(delay, 1),
+                            "error": repr(e),
+                        }
+                    },
+                )
+                await self.call(self.broker.nack, task, self.name, repr(e), delay)
+            else:
+                await self.call(self.broker.ack, task, self.name)
+
+    async def search(self, task):
+        query = task.payload
+        api = self.api(query)
+        page = query["page"]
+        url = api.search_url(page)
+        response = await api.fetch(url)
+        if response is None:
+            raise FetchError(url)
+        cards, has_next = await api.search_results(response)
+        key = query_key(query)
+        query = {k: v for k, v in query.items() if k != "page"}
+        for card in cards:
+            await self.call(
+                self.broker.put,
+                "product",
+                f"product|{key}|{card['asin']}",
+                {**query, "card": card},
+            )
+        if cards and has_next and page < MAX_PAGES:
+            # product pages first, so results flow while later search pages wait
+            await self.call(
+                self.broker.put,
+                "search",
+                f"search|{key}|{page + 1}",
+                {**query, "page": page + 1},
+                1,
+            )
+        logger.info(
+            f"Page {page}: got {len(cards)} products.",
+            extra={"fields": {"search_term": query["term"], "page": page}},
+        )
+
+    async def product(self, task):
+        query = task.payload
+        api = self.api(query)
+        card = query["card"]
+        # not parse_card: its per-process memo would serve a long-lived worker
+        # the products of an earlier crawl
+        product = await api.parse_new_card(card)
+        if api.store:
+            api.store.add(product, api.search_term)
+        if product:
+            await self.call(
+                self.broker.add_result,
+                query_key(query),
+                card["asin"],
+                product,
+                self.name,
+            )
+
+
+def write_reports(broker, queries):
+    for query in queries:
+        data = remove_empty_elements(broker.results(query_key(query)))
+        GenerateReport(
+            query_name(query["term"], query["filters"]),
+            query["filters"],
+            BASE_URL,
+            query["currency"],
+            data,
+            search_term=query["term"],
+        )
+
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def spawn_workers(args, count):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--broker",
+        args.broker,
+        "worker",
+        "--exit-when-idle",
+        "--concurrency",
+        str(args.concurrency),
+        "--rate",
+        str(args.rate),
+    ]
+    return [subprocess.Popen(command) for _ in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed crawl over a work queue")
+    parser.add_argument("--broker", default=BROKER_URL, help="e.g. sqlite:///queue.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit", help="queue a watchlist")
+    submit_parser.add_argument("watchlist")
+    worker_parser = commands.add_parser("worker", help="crawl queued tasks")
+    run_parser = commands.add_parser(
+        "run", help="queue a watchlist, crawl it with local workers, write reports"
+    )
+    run_parser.add_argument("watchlist")
+    run_parser.add_argument("--workers", type=int, default=2)
+    for command in (submit_parser, run_parser):
+        command.add_argument(
+            "--fresh", action="store_true", help="drop earlier tasks and results"
+        )
+    for command in (worker_parser, run_parser):
+        command.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+        command.add_argument(
+            "--rate", type=float, default=REQUESTS_PER_SECOND, help="requests/second"
+        )
+    worker_parser.add_argument(
+        "--exit-when-idle", action="store_true", help="stop once the queue is drained"
+    )
+    report_parser = commands.add_parser("report", help="write reports from results")
+    report_parser.add_argument("watchlist")
+    commands.add_parser("status", help="task counts by kind and state")
+    args = parser.parse_args()
+
+    setup_logging()
+    broker = make_broker(args.broker)
+    if args.command in ("submit", "run") and args.fresh:
+        broker.reset()
+    if args.command == "submit":
+        submit(broker, load_watchlist(args.watchlist))
+    elif args.command == "worker":
+        worker = Worker(broker, worker_name(), args.concurrency, args.rate)
+        asyncio.run(worker.run(args.exit_when_idle))
+    elif args.command == "run":
+        queries = load_watchlist(args.watchlist)
+        submit(broker, queries)
+        for process in spawn_workers(args, args.workers):
+            process.wait()
+        logger.info("Queue drained", extra={"fields": broker.counts()})
+        write_reports(broker, queries)
+    elif args.command == "report":
+        write_reports(broker, load_watchlist(args.watchlist))
+    else:
+        for state, n in sorted(broker.counts().items()):
+            print(f"{state}: {n}")
+    broker.close()
@@ -0,0 +1,285 @@
+import time
+import logging
+from parsers import parse_document
+from amazon_config import PRODUCT_URL
+
+logger = logging.getLogger("extractors")
+
+EXCLUDED_ASINS = ("B015HS4O1K",)
+REQUIRED_FIELDS = ("title", "price", "rating")
+# a page only goes to the browser when one of these is missing from the static html
+PRODUCT_SELECTORS = (
+    "span#productTitle",
+    "span.apexPriceToPay, span#priceblock_ourprice, span.a-color-price",
+)
+SEARCH_SELECTORS = ("div[data-asin]",)
+
+
+def needs_render(html, selectors):
+    return any(html.find(selector, first=True) is None for selector in selectors)
+
+
+def parse_price(text):
+    """'$1,299.99' -> 1299.99"""
+    return float(text.split("$")[1].replace(",", "").strip())
+
+
+def _first(element, selector):
+    return element.find(selector, first=True)
+
+
+def parse_search_card(card):
+    """build a product record from a search result `div[data-asin]` card"""
+    asin = card.attrs["data-asin"]
+    product = {
+        "asin": asin,
+        "url": PRODUCT_URL + asin,
+        "title": None,
+        "price": None,
+        "rating": None,
+        "photo_url": None,
+        "seller": None,
+        "review_count": None,
+    }
+    title = _first(card, "h2 span")
+    if title is not None:
+        product["title"] = title.text
+    price = _first(card, "span.a-price span.a-offscreen")
+    if price is not None:
+        try:
+            product["price"] = parse_price(price.text)
+        except (IndexError, ValueError):
+            pass
+    rating = _first(card, "span.a-icon-alt")
+    if rating is not None:
+        try:
+            product["rating"] = float(rating.text.split(" ")[0])
+        except ValueError:
+            pass
+    review_count = _first(card, "a[href*='customerReviews'] span.a-size-base")
+    if review_count is not None:
+        try:
+            product["review_count"] = int(review_count.text.replace(",", "").strip())
+        except ValueError:
+            pass
+    photo = _first(card, "img.s-image")
+    if photo is not None:
+        product["photo_url"] = photo.attrs.get("src")
+    return product
+
+
+def parse_search_cards(html):
+    return [
+        parse_search_card(card)
+        for card in html.find("div[data-asin]")
+        if card.attrs["data-asin"] != ""
+        and card.attrs["data-asin"] not in EXCLUDED_ASINS
+    ]
+
+
+def parse_search_page(content, url):
+    """raw search page -> (cards, has_next, needs_render); safe to run in a worker process"""
+    html = parse_document(content, url)
+    has_next = html.find("a.s-pagination-next", first=True) is not None
+    return parse_search_cards(html), has_next, needs_render(html, SEARCH_SELECTORS)
+
+
+def parse_product_page(content, url):
+    """
+    raw product page -> (product, needs_render, strategies, timings); safe to
+    run in a worker process
+    """
+    page = PageQuery(parse_document(content, url))
+    product, strategies, timings = extract_product(page, url)
+    return product, needs_render(page, PRODUCT_SELECTORS), strategies, timings
+
+
+def parse_product(html, url):
+    """extract every field of a product page from one parsed document"""
+    product, _, _ = extract_product(PageQuery(html), url)
+    return product
+
+
+def extract_product(page, url):
+    product = {"asin": url.split("/")[4], "url": url}
+    strategies = {}
+    # seconds spent on each field, so slow selectors show up in the metrics
+    timings = {}
+    for extractor in PRODUCT_FIELDS:
+        started = time.perf_counter()
+        product[extractor.field], strategies[extractor.field] = extractor.extract(page)
+        timings[extractor.field] = time.perf_counter() - started
+        if product[extractor.field] is None:
+            logger.debug(
+                f"Can't get a {extractor.field} of a product",
+                extra={"fields": {"url": url, "field": extractor.field}},
+            )
+    return product, strategies, timings
+
+
+class PageQuery:
+    """memoizes `find(selector, first=True)` so each selector hits a page once"""
+
+    def __init__(self, html):
+        self.html = html
+        self.results = {}
+
+    def find(self, selector, first=True):
+        if selector not in self.results:
+            self.results[selector] = self.html.find(selector, first=True)
+        return self.results[selector]
+
+
+class Strategy:
+    """one way of getting a field: a selector plus a post-processor of the element"""
+
+    def __init__(self, name, selector, process):
+        self.name = name
+        self.selector = selector
+        self.process = process
+
+
+class FieldExtractor:
+    """
+    tries its strategies in order and returns the first value; with `reorder`
+    the order is re-sorted by hit count every `reorder_every` pages so the
+    strategy that matches the current layout is tried first. Fields whose
+    strategies are ranked by precedence rather than interchangeable keep
+    their order.
+    """
+
+    def __init__(self, field, strategies, reorder=True, reorder_every=50):
+        self.field = field
+        self.strategies = list(strategies)
+        self.reorder = reorder
+        self.reorder_every = reorder_every
+        self.hits = {strategy.name: 0 for strategy in self.strategies}
+        self.misses = 0
+        self.calls = 0
+
+    def extract(self, page):
+        self.calls += 1
+        if self.reorder and self.calls % self.reorder_every == 0:
+            self.strategies.sort(key=lambda s: self.hits[s.name], reverse=True)
+        for strategy in self.strategies:
+            element = page.find(strategy.selector)
+            if element is None:
+                continue
+            try:
+                value = strategy.process(element)
+            except (AttributeError, IndexError, KeyError, ValueError):
+                continue
+            if value is None:
+                continue
+            self.hits[strategy.name] += 1
+            return value, strategy.name
+        self.misses += 1
+        return None, None
+
+
+def text(element):
+    return element.text.strip() or None
+
+
+def byline(element):
+    seller = element.text
+    if "Visit the" in seller:
+        return " ".join(seller.split(" ")[2:])
+    return seller
+
+
+def unavailable(element):
+    if "Currently unavailable." in element.text:
+        return 0.0
+    if "Temporarily out of stock." in element.text:
+        return 0.0
+    return None
+
+
+PRODUCT_FIELDS = (
+    FieldExtractor(
+        "title",
+        (
+            Strategy("product_title", "span#productTitle", text),
+            Strategy("h1_large", "h1.a-size-large", text),
+        ),
+    ),
+    FieldExtractor(
+        "price",
+        (
+            Strategy("apex", "span.apexPriceToPay", lambda e: parse_price(e.text)),
+            Strategy(
+                "our_price", "span#priceblock_ourprice", lambda e: parse_price(e.text)
+            ),
+            Strategy(
+                "color_price",
+                "span.a-color-price:nth-child(2)",
+                lambda e: parse_price(e.text),
+            ),
+            Strategy("unavailable", "span.a-color-price", unavailable),
+            Strategy(
+                "availability_message", "span.qa-availability-message", unavailable
+            ),
+            Strategy("availability", "div#availability", unavailable),
+        ),
+        # the buy-box price beats the fallbacks whenever it is on the page
+        reorder=False,
+    ),
+    FieldExtractor(
+        "rating",
+        (
+            Strategy(
+                "icon_alt", "span.a-icon-alt", lambda e: float(e.text.split(" ")[0])
+            ),
+        ),
+    ),
+    FieldExtractor(
+        "photo_url",
+        (Strategy("landing_image", "img#landingImage", lambda e: e.attrs["src"]),),
+    ),
+    FieldExtractor(
+        "seller",
+        (
+            Strategy("byline", "a#bylineInfo", byline),
+            Strategy("qa_byline", "a.qa-byline-url", text),
+        ),
+    ),
+    FieldExtractor(
+        "review_count",
+        (
+            Strategy(
+                "review_text",
+                "span#acrCustomerReviewText",
+                lambda e: int(e.text.split(" ")[0].replace(",", "").strip()),
+            ),
+        ),
+    ),
+)
+
+
+class ExtractionStats:
+    """hit counts per field and strategy, aggregated from parse_product_page results"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def record(self, strategies):
+        for field, name in strategies.items():
+            counts = self.counts.setdefault(field, {})
+            key = name or "miss"
+            counts[key] = counts.get(key, 0) + 1
+
+    def summary(self):
+        summary = {}
+        for field, counts in self.counts.items():
+            total = sum(counts.values())
+            summary[field] = {
+                "total": total,
+                "hit_rate": round(1 - counts.get("miss", 0) / total, 4),
+                "counts": dict(sorted(counts.items(), key=lambda c: -c[1])),
+            }
+        return summary
+
+
+def is_complete(product):
+    return all(product.get(field) for field in REQUIRED_FIELDS)
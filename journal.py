@@ -0,0 +1,90 @@
+import os
+import json
+import logging
+
+logger = logging.getLogger("journal")
+
+
+class CrawlJournal:
+    """
+    append-only ndjson log of a crawl: every discovered search card, every
+    finished search page and every completed product. Replaying it after a
+    crash gives back the frontier still to do, so `--resume` only fetches
+    the remaining work.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.cards = {}
+        self.completed = {}
+        self.last_page = 0
+        self.search_done = False
+        if resume and os.path.exists(path):
+            self.replay()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.handle = open(path, "a" if resume else "w")
+        if resume and self.handle.tell() > 0:
+            # terminate a line the crash may have cut short
+            self.handle.write("\n")
+
+    def replay(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short by the crash
+                    logger.warning(
+                        "Skipping a damaged journal line",
+                        extra={"fields": {"path": self.path}},
+                    )
+                    continue
+                if event["type"] == "card":
+                    self.cards[event["card"]["asin"]] = event["card"]
+                elif event["type"] == "page":
+                    self.last_page = max(self.last_page, event["page"])
+                    self.search_done = self.search_done or event["last"]
+                elif event["type"] == "done":
+                    self.completed[event["asin"]] = event["product"]
+
+    def pending(self):
+        return [card for asin, card in self.cards.items() if asin not in self.completed]
+
+    def write(self, event):
+        self.handle.write(json.dumps(event) + "\n")
+        self.handle.flush()
+
+    def card(self, card):
+        self.cards[card["asin"]] = card
+        self.write({"type": "card", "card": card})
+
+    def page(self, page, last):
+        self.last_page = page
+        self.search_done = last
+        self.write({"type": "page", "page": page, "last": last})
+
+    def done(self, asin, product):
+        self.completed[asin] = product
+        self.write({"type": "done", "asin": asin, "product": product})
+
+    def finish(self):
+        """
+        the crawl ended; the journal is removed only when the search ran to
+        its last page and every product is done, otherwise it stays for
+        `--resume`
+        """
+        self.handle.close()
+        pending = self.pending()
+        if self.search_done and not pending:
+            os.remove(self.path)
+            return
+        logger.warning(
+            "Crawl incomplete, run again with --resume",
+            extra={
+                "fields": {
+                    "path": self.path,
+                    "pending": len(pending),
+                    "search_done": self.search_done,
+                }
+            },
+        )
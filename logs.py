@@ -0,0 +1,104 @@
+import sys
+import time
+import json
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from extractors import is_complete
+from amazon_config import LOG_LEVEL, LOG_FORMAT, LOG_FILE
+
+# third party loggers that are chatty below WARNING
+QUIET_LOGGERS = ("pyppeteer", "websockets", "urllib3", "asyncio")
+
+
+class JsonFormatter(logging.Formatter):
+    """one json object per record; `extra={"fields": {...}}` is merged in"""
+
+    def format(self, record):
+        event = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        event.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """`time level logger: message key=value ...` for reading in a terminal"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", {})
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging(level=LOG_LEVEL, format=LOG_FORMAT, path=LOG_FILE):
+    """
+    route every record through a queue to a listener thread that does the
+    actual writing, so logging never blocks the event loop on stdout
+    """
+    formatter = JsonFormatter() if format == "json" else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if path:
+        handlers.append(logging.FileHandler(path))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(records)]
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def quiet_worker():
+    """
+    parser processes inherit the queue handler but not its listener; their
+    per-field misses reach the log through log_product in the parent
+    """
+    logging.getLogger().handlers = [logging.NullHandler()]
+
+
+def log_product(logger, product, strategies, rendered, started, fetched):
+    """one record per product page; per-field lines only at DEBUG"""
+    now = time.perf_counter()
+    logger.info(
+        "Got product",
+        extra={
+            "fields": {
+                **product,
+                "missing": [field for field, name in strategies.items() if not name],
+                "complete": is_complete(product),
+                "rendered": rendered,
+                "fetch_seconds": round(fetched - started, 4),
+                "parse_seconds": round(now - fetched, 4),
+            }
+        },
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        for field, name in strategies.items():
+            logger.debug(
+                "Field",
+                extra={
+                    "fields": {
+                        "url": product["url"],
+                        "field": field,
+                        "value": product.get(field),
+                        "strategy": name,
+                    }
+                },
+            )
@@ -0,0 +1,221 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger("metrics")
+
+# upper bounds in seconds; wide enough for a 1ms selector and a 60s render
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+class Histogram:
+    """cumulative-bucket latency histogram in the prometheus layout"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            yield bound, seen
+
+
+class Metrics:
+    """
+    counters and latency histograms of a crawl, keyed by metric name and
+    labels; exported as prometheus text and as an end-of-run summary
+    """
+
+    def __init__(self, prefix="amazon_scraper"):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """time the block as `stage_seconds{stage=...}`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(
+                "stage_seconds", time.perf_counter() - started, stage=stage, **labels
+            )
+
+    def record_response(self, kind, response):
+        self.inc("requests_total", kind=kind, status=str(response.status_code))
+        self.inc("response_bytes_total", len(response.content), kind=kind)
+
+    def record_extraction(self, strategies, timings):
+        """per-field outcome and time of one parse_product_page call"""
+        for field, seconds in timings.items():
+            self.observe("extractor_seconds", seconds, field=field)
+        for field, name in strategies.items():
+            if name is None:
+                self.inc("extraction_failures_total", field=field)
+
+    def prometheus(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda h: h[0])
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(
+                    f"{metric}_bucket{format_labels(labels + (('le', le),))} {count}"
+                )
+            lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """totals per counter and count/mean/p50/p90/p99/max per histogram"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda h: h[0])
+        summary = {
+            "wall_seconds": round(time.time() - self.started, 3),
+            "counters": {},
+            "latency": {},
+        }
+        for (name, labels), value in counters:
+            summary["counters"][name + format_labels(labels)] = value
+        for (name, labels), histogram in histograms:
+            summary["latency"][name + format_labels(labels)] = {
+                "count": histogram.count,
+                "total": round(histogram.sum, 4),
+                "mean": round(histogram.sum / histogram.count, 4),
+                "p50": round(histogram.quantile(0.5), 4),
+                "p90": round(histogram.quantile(0.9), 4),
+                "p99": round(histogram.quantile(0.99), 4),
+                "max": round(histogram.max, 4),
+            }
+        return summary
+
+    def log_summary(self):
+        summary = self.summary()
+        logger.info(
+            f"Run took {summary['wall_seconds']}s",
+            extra={"fields": {"counters": summary["counters"]}},
+        )
+        stages = [
+            (key, stats)
+            for key, stats in summary["latency"].items()
+            if key.startswith("stage_seconds")
+        ]
+        for key, stats in sorted(stages, key=lambda s: -s[1]["total"]):
+            logger.info(
+                f"{key}: {stats['count']} calls, {stats['total']}s total, "
+                f"p50 {stats['p50']}s p99 {stats['p99']}s",
+                extra={"fields": {"metric": key, **stats}},
+            )
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.prometheus())
+
+    def serve(self, port):
+        """expose /metrics on `port` from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                data = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://localhost:{port}/metrics")
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + pairs + "}"
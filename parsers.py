@@ -0,0 +1,110 @@
+import sys
+import time
+from functools import lru_cache
+from requests_html import HTML
+from amazon_config import PARSER_BACKEND
+
+try:
+    import lxml.html
+    from lxml.cssselect import CSSSelector
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+BACKENDS = ("selectolax", "lxml", "requests_html")
+
+
+def squash(text):
+    # requests_html collapses whitespace in .text, the fast backends have to match
+    return " ".join(text.split())
+
+
+@lru_cache(maxsize=None)
+def compiled(selector):
+    return CSSSelector(selector)
+
+
+class LxmlElement:
+    """requests_html-style `find`/`text`/`attrs` over a bare lxml element"""
+
+    __slots__ = ("element",)
+
+    def __init__(self, element):
+        self.element = element
+
+    @property
+    def text(self):
+        return squash(self.element.text_content())
+
+    @property
+    def attrs(self):
+        return dict(self.element.attrib)
+
+    def find(self, selector, first=False):
+        matches = compiled(selector)(self.element)
+        if first:
+            return LxmlElement(matches[0]) if matches else None
+        return [LxmlElement(match) for match in matches]
+
+
+class SelectolaxElement:
+    """requests_html-style `find`/`text`/`attrs` over a selectolax node"""
+
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        self.node = node
+
+    @property
+    def text(self):
+        return squash(self.node.text())
+
+    @property
+    def attrs(self):
+        return {k: v or "" for k, v in self.node.attributes.items()}
+
+    def find(self, selector, first=False):
+        if first:
+            match = self.node.css_first(selector)
+            return SelectolaxElement(match) if match is not None else None
+        return [SelectolaxElement(match) for match in self.node.css(selector)]
+
+
+def available(backend):
+    if backend == "selectolax":
+        return HTMLParser is not None
+    if backend == "lxml":
+        return lxml is not None
+    return True
+
+
+def parse_document(content, url, backend=PARSER_BACKEND):
+    """parse raw markup with the configured backend, falling back to requests_html"""
+    if backend == "selectolax" and HTMLParser is not None:
+        return SelectolaxElement(HTMLParser(content))
+    if backend == "lxml" and lxml is not None:
+        return LxmlElement(lxml.html.fromstring(content))
+    return HTML(url=url, html=content)
+
+
+if __name__ == "__main__":
+    # python parsers.py page.html [rounds] -- per-backend parse + extract time
+    from extractors import PageQuery, extract_product
+
+    with open(sys.argv[1], "rb") as f:
+        content = f.read()
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    url = "https://www.amazon.com/dp/BENCHMARK0"
+    for backend in BACKENDS:
+        if not available(backend):
+            print(f"{backend}: not installed")
+            continue
+        started = time.perf_counter()
+        for _ in range(rounds):
+            extract_product(PageQuery(parse_document(content, url, backend)), url)
+        elapsed = (time.perf_counter() - started) / rounds
+        print(f"{backend}: {elapsed * 1000:.2f} ms per page")
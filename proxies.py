@@ -0,0 +1,154 @@
+import time
+import random
+import logging
+
+logger = logging.getLogger("proxies")
+
+# header profiles rotated together with the egress path; each endpoint keeps
+# one profile so a given ip always looks like the same browser
+IDENTITIES = (
+    {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:96.0) "
+        "Gecko/20100101 Firefox/96.0",
+        "Accept-Language": "en-US,en;q=0.5",
+    },
+    {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept-Language": "en-US,en;q=0.9",
+    },
+    {
+        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15",
+        "Accept-Language": "en-US,en;q=0.9",
+    },
+    {
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:121.0) "
+        "Gecko/20100101 Firefox/121.0",
+        "Accept-Language": "en-US,en;q=0.7",
+    },
+)
+# weight of the newest sample in the moving averages
+ALPHA = 0.2
+
+
+class Endpoint:
+    """one egress path (a proxy url, or None for a direct connection) and its health"""
+
+    def __init__(self, proxy, identity):
+        self.proxy = proxy
+        self.identity = identity
+        self.success_rate = 1.0
+        self.latency = 1.0
+        self.requests = 0
+        self.blocks = 0
+        self.errors = 0
+        # failures in a row since the last success
+        self.failures = 0
+        self.strikes = 0
+        self.quarantined_until = 0.0
+
+    @property
+    def name(self):
+        return self.proxy or "direct"
+
+    def healthy(self, now):
+        return self.quarantined_until <= now
+
+    def score(self):
+        """expected successes per second of waiting"""
+        return self.success_rate / max(self.latency, 0.01)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "blocks": self.blocks,
+            "errors": self.errors,
+            "success_rate": round(self.success_rate, 3),
+            "latency": round(self.latency, 3),
+            "strikes": self.strikes,
+        }
+
+
+class ProxyPool:
+    """
+    rotates requests over proxies and header identities. Success rate and
+    latency are tracked per endpoint as moving averages and traffic goes to
+    the better of two random healthy endpoints. A stray block is not enough
+    to bench an endpoint: only `max_failures` failures in a row or a success
+    rate below `min_success_rate` quarantine it, for `cooldown * 2**strikes`
+    seconds (capped), and a success after release clears its strikes.
+    """
+
+    def __init__(
+        self,
+        proxies,
+        cooldown,
+        max_cooldown,
+        max_failures=3,
+        min_success_rate=0.5,
+        identities=IDENTITIES,
+    ):
+        self.identities = list(identities)
+        self.endpoints = [
+            Endpoint(proxy, self.identities[i % len(self.identities)])
+            for i, proxy in enumerate(proxies or [None])
+        ]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_failures = max_failures
+        self.min_success_rate = min_success_rate
+
+    def choose(self):
+        now = time.monotonic()
+        healthy = [e for e in self.endpoints if e.healthy(now)]
+        if not healthy:
+            # everything is cooling down; keep going through the least bad one
+            return max(self.endpoints, key=lambda e: e.score())
+        if len(healthy) == 1:
+            return healthy[0]
+        first, second = random.sample(healthy, 2)
+        return first if first.score() >= second.score() else second
+
+    def record(self, endpoint, ok, latency=None, blocked=False):
+        endpoint.requests += 1
+        endpoint.success_rate += ALPHA * (ok - endpoint.success_rate)
+        if latency is not None:
+            endpoint.latency += ALPHA * (latency - endpoint.latency)
+        if ok:
+            endpoint.failures = 0
+            endpoint.strikes = 0
+            return
+        if blocked:
+            endpoint.blocks += 1
+        else:
+            endpoint.errors += 1
+        endpoint.failures += 1
+        if (
+            endpoint.failures >= self.max_failures
+            or endpoint.success_rate < self.min_success_rate
+        ):
+            self.quarantine(endpoint)
+
+    def quarantine(self, endpoint):
+        seconds = min(self.max_cooldown, self.cooldown * 2**endpoint.strikes)
+        endpoint.strikes += 1
+        endpoint.failures = 0
+        endpoint.quarantined_until = time.monotonic() + seconds
+        if len(self.identities) > 1:
+            # come back looking like a different browser
+            others = [i for i in self.identities if i is not endpoint.identity]
+            endpoint.identity = random.choice(others)
+        logger.info(
+            "Quarantined",
+            extra={
+                "fields": {
+                    "proxy": endpoint.name,
+                    "seconds": round(seconds, 1),
+                    **endpoint.stats(),
+                }
+            },
+        )
+
+    def stats(self):
+        return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
@@ -0,0 +1,95 @@
+import asyncio
+import pyppeteer
+from urllib.parse import urlsplit
+from requests_html import HTML
+
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font", "stylesheet")
+
+
+class RenderPool:
+    """
+    headless chromium with a fixed pool of warm pages per egress path (one
+    browser per proxy, as chromium takes its proxy at launch); the pool size
+    is also the render concurrency limit of each browser
+    """
+
+    def __init__(self, size, timeout, user_agent=None):
+        self.size = size
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.browsers = {}
+        self.pages = {}
+        self._lock = asyncio.Lock()
+
+    async def start(self, proxy=None):
+        async with self._lock:
+            if proxy in self.browsers:
+                return
+            args = ["--no-sandbox"]
+            if proxy:
+                parts = urlsplit(proxy)
+                args.append(
+                    f"--proxy-server={parts.scheme}://{parts.netloc.split('@')[-1]}"
+                )
+            browser = await pyppeteer.launch(
+                headless=True,
+                args=args,
+                handleSIGINT=False,
+                handleSIGTERM=False,
+                handleSIGHUP=False,
+            )
+            pages = asyncio.Queue()
+            for _ in range(self.size):
+                pages.put_nowait(await self.new_page(browser, proxy))
+            self.browsers[proxy] = browser
+            self.pages[proxy] = pages
+
+    async def new_page(self, browser, proxy=None):
+        page = await browser.newPage()
+        if self.user_agent:
+            await page.setUserAgent(self.user_agent)
+        if proxy:
+            parts = urlsplit(proxy)
+            if parts.username:
+                await page.authenticate(
+                    {"username": parts.username, "password": parts.password or ""}
+                )
+        await page.setRequestInterception(True)
+        page.on(
+            "request", lambda request: asyncio.ensure_future(self.intercept(request))
+        )
+        return page
+
+    @staticmethod
+    async def intercept(request):
+        if request.resourceType in BLOCKED_RESOURCE_TYPES:
+            await request.abort()
+        else:
+            await request.continue_()
+
+    async def render(self, url, headers=None, proxy=None):
+        await self.start(proxy)
+        page = await self.pages[proxy].get()
+        try:
+            if headers:
+                headers = dict(headers)
+                await page.setUserAgent(headers.pop("User-Agent", self.user_agent))
+                await page.setExtraHTTPHeaders(headers)
+            await page.goto(
+                url, timeout=self.timeout * 1000, waitUntil="domcontentloaded"
+            )
+            content = await page.content()
+        except Exception:
+            # a page stuck in a failed navigation is not worth reusing
+            await page.close()
+            page = await self.new_page(self.browsers[proxy], proxy)
+            raise
+        finally:
+            self.pages[proxy].put_nowait(page)
+        return HTML(url=url, html=content)
+
+    async def close(self):
+        for browser in self.browsers.values():
+            await browser.close()
+        self.browsers = {}
+        self.pages = {}
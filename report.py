@@ -0,0 +1,158 @@
+import json
+import logging
+from datetime import datetime
+import columnar
+from amazon_config import DIRECTORY
+
+logger = logging.getLogger("report")
+
+
+def remove_empty_elements(d):
+    """recursively remove empty lists, empty dicts, or None elements from a dictionary"""
+
+    def empty(x):
+        return x is None or x == {} or x == []
+
+    if not isinstance(d, (dict, list)):
+        return d
+    elif isinstance(d, list):
+        return [v for v in (remove_empty_elements(v) for v in d) if not empty(v)]
+    else:
+        return {
+            k: v
+            for k, v in ((k, remove_empty_elements(v)) for k, v in d.items())
+            if not empty(v)
+        }
+
+
+def query_name(search_term, filters):
+    """
+    file name of one watchlist query's journal and reports: the term and its
+    price band, so several bands of one term do not overwrite each other
+    """
+    return f"{search_term}_{filters['min']}-{filters['max']}"
+
+
+def report_analytics(search_term, products=None, path=None, snapshot=True):
+    """
+    price statistics, weighted top rated products and price drops of a
+    report, computed column-wise; None when pyarrow/numpy are missing
+    """
+    if not columnar.available():
+        return None
+    if path is not None:
+        table = columnar.read_ndjson(path, search_term)
+    else:
+        table = columnar.product_table(products, search_term)
+    return columnar.snapshot_analytics(table, search_term, snapshot)
+
+
+class StreamingReport:
+    """
+    appends every cleaned product to `{file_name}.ndjson` as soon as it is
+    parsed and keeps only running aggregates in memory; `close` writes the
+    summary to `{file_name}.summary.json`
+    """
+
+    def __init__(
+        self, file_name, filters, base_link, currency, snapshot=True, search_term=None
+    ):
+        self.file_name = file_name
+        self.search_term = search_term or file_name
+        self.filters = filters
+        self.base_link = base_link
+        self.currency = currency
+        self.snapshot = snapshot
+        self.count = 0
+        self.best_item = None
+        self.handle = open(f"{DIRECTORY}/{file_name}.ndjson", "w")
+
+    def add(self, product):
+        product = remove_empty_elements(product)
+        if not product:
+            return
+        self.handle.write(json.dumps(product) + "\n")
+        self.handle.flush()
+        self.count += 1
+        if self.best_item is None or product.get("rating", 0) > self.best_item.get(
+            "rating", 0
+        ):
+            self.best_item = product
+
+    def close(self):
+        self.handle.close()
+        summary = {
+            "title": self.file_name,
+            "date": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            "product_count": self.count,
+            "best_item": self.best_item,
+            "currency": self.currency,
+            "filters": self.filters,
+            "base_link": self.base_link,
+            "products": f"{self.file_name}.ndjson",
+        }
+        analytics = None
+        if self.count:
+            # pyarrow cannot read an empty stream
+            analytics = report_analytics(
+                self.search_term,
+                path=f"{DIRECTORY}/{self.file_name}.ndjson",
+                snapshot=self.snapshot,
+            )
+        if analytics is not None:
+            summary["analytics"] = analytics
+        logger.info("Creating Report...", extra={"fields": {"report": self.file_name}})
+        with open(f"{DIRECTORY}/{self.file_name}.summary.json", "w") as f:
+            json.dump(summary, f)
+        logger.info("Done.")
+
+
+class GenerateReport:
+    def __init__(
+        self,
+        file_name,
+        filters,
+        base_link,
+        currency,
+        data,
+        snapshot=True,
+        search_term=None,
+    ):
+
+        self.data = data
+        self.file_name = file_name
+        self.filters = filters
+        self.base_link = base_link
+        self.currency = currency
+
+        report = {
+            "title": self.file_name,
+            "date": self.get_now(),
+            "product_count": len(self.data),
+            "best_item": self.get_best_item(),
+            "currency": self.currency,
+            "filters": self.filters,
+            "base_link": self.base_link,
+            "products": self.data,
+        }
+        analytics = report_analytics(
+            search_term or file_name, self.data, snapshot=snapshot
+        )
+        if analytics is not None:
+            report["analytics"] = analytics
+        logger.info("Creating Report...", extra={"fields": {"report": file_name}})
+        with open(f"{DIRECTORY}/{file_name}.json", "w") as f:
+            json.dump(report, f)
+        logger.info("Done.")
+
+    @staticmethod
+    def get_now():
+        now = datetime.now()
+        return now.strftime("%d/%m/%Y %H:%M:%S")
+
+    def get_best_item(self):
+        try:
+            return max(self.data, key=lambda x: x["rating"], default=None)
+        except Exception:
+            logger.exception("Problem with sorting items")
+            return None
@@ -0,0 +1,312 @@
+import time
+import heapq
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from throttle import TokenBucket
+from logs import setup_logging
+from batch import load_watchlist
+from store import PriceStore
+from distributed import query_key
+from scraper_async import AmazonAPI, CrawlContext, FetchError
+from amazon_config import (
+    BASE_URL,
+    MAX_PAGES,
+    MAX_CONCURRENCY,
+    PRODUCT_URL,
+    SCHEDULE_BUDGET,
+    SCHEDULE_MIN_INTERVAL,
+    SCHEDULE_MAX_INTERVAL,
+    SCHEDULE_QUERY_INTERVAL,
+    SCHEDULE_WINDOW,
+)
+
+logger = logging.getLogger("scheduler")
+
+# longest sleep of an idle worker, so newly found ASINs do not wait for it
+POLL_INTERVAL = 5.0
+
+
+def count_changes(history):
+    """changes of price, rating or availability between consecutive observations"""
+    changes = 0
+    previous = None
+    for row in history:
+        state = (row["price"], row["rating"], row["price"] is not None)
+        if previous is not None and state != previous:
+            changes += 1
+        previous = state
+    return changes
+
+
+def adaptive_interval(
+    history, flips=0, minimum=SCHEDULE_MIN_INTERVAL, maximum=SCHEDULE_MAX_INTERVAL
+):
+    """
+    mean time between changes over the observed span, counting one change
+    more than seen: a product that keeps its price about doubles its interval
+    with every visit, and each change pulls it back
+    """
+    if len(history) < 2:
+        return minimum
+    span = history[-1]["observed_at"] - history[0]["observed_at"]
+    changes = count_changes(history) + flips
+    return min(maximum, max(minimum, span / (changes + 1)))
+
+
+class Tracked:
+    """a query or ASIN the scheduler revisits, and when"""
+
+    def __init__(self, kind, key, query, url=None):
+        self.kind = kind
+        self.key = key
+        self.query = query
+        self.url = url
+        self.interval = (
+            SCHEDULE_QUERY_INTERVAL if kind == "query" else SCHEDULE_MIN_INTERVAL
+        )
+        # requests per visit; a query costs one per search page
+        self.cost = 1
+        self.due = 0.0
+        self.available = True
+        self.flips = 0
+
+
+class Scheduler:
+    """
+    long-running crawl of a watchlist: queries are re-read every
+    SCHEDULE_QUERY_INTERVAL for new ASINs, and every ASIN is revisited on its
+    own interval, adapted to how often its price, rating or availability
+    changed. When the intervals ask for more than `budget` requests an hour
+    they are all stretched by the same factor, and a token bucket that every
+    request of the crawl (retries and renders included) draws from holds it
+    to the budget either way.
+    """
+
+    def __init__(
+        self, queries, budget=SCHEDULE_BUDGET, concurrency=MAX_CONCURRENCY, name=None
+    ):
+        self.queries = queries
+        self.budget = budget
+        self.concurrency = concurrency
+        self.name = name or "scheduler"
+        # at most a minute's worth of requests in one burst
+        self.bucket = TokenBucket(budget / 3600, max(1.0, budget / 60))
+        self.items = {}
+        # running total of what the intervals ask for, kept up to date by
+        # add() and update() so scheduling does not sum over every item
+        self.requests_per_hour = 0.0
+        self.heap = []
+        self.apis = {}
+        self.context = None
+        self.store = None
+
+    @staticmethod
+    def rate(item):
+        return item.cost * 3600 / item.interval
+
+    def add(self, item):
+        self.items[item.key] = item
+        self.requests_per_hour += self.rate(item)
+
+    def update(self, item, interval=None, cost=None):
+        self.requests_per_hour -= self.rate(item)
+        item.interval = interval or item.interval
+        item.cost = cost or item.cost
+        self.requests_per_hour += self.rate(item)
+
+    def demand(self):
+        """requests an hour the current intervals ask for"""
+        return self.requests_per_hour
+
+    def stretch(self):
+        return max(1.0, self.demand() / self.budget)
+
+    def schedule(self, item, last):
+        item.due = last + item.interval * self.stretch()
+        heapq.heappush(self.heap, (item.due, item.key))
+
+    def load(self, store):
+        """track every query and every ASIN the store has seen for them"""
+        now = time.time()
+        last_seen = {}
+        for query in self.queries:
+            key = query_key(query)
+            self.add(Tracked("query", key, query))
+            last_seen[key] = 0.0
+            for row in store.latest(query["term"]):
+                asin = row["asin"]
+                last_seen[key] = max(last_seen[key], row["observed_at"])
+                if asin in self.items:
+                    continue
+                url = row["url"] or PRODUCT_URL + asin
+                item = Tracked("product", asin, query, url)
+                history = store.history(asin, now - SCHEDULE_WINDOW)
+                item.interval = adaptive_interval(history)
+                self.add(item)
+                last_seen[asin] = history[-1]["observed_at"] if history else 0.0
+        for key, item in self.items.items():
+            self.schedule(item, last_seen[key])
+
+    def track(self, asin, query, url):
+        item = Tracked("product", asin, query, url)
+        self.add(item)
+        item.due = time.time()
+        heapq.heappush(self.heap, (item.due, asin))
+
+    def api(self, query):
+        key = query_key(query)
+        if key not in self.apis:
+            self.apis[key] = AmazonAPI(
+                query["term"],
+                query["filters"],
+                BASE_URL,
+                query["currency"],
+                self.context,
+            )
+        return self.apis[key]
+
+    async def run(self):
+        self.context = CrawlContext(self.name)
+        if self.context.store is None:
+            self.context.store = PriceStore()
+        self.store = self.context.store
+        self.context.budget = self.bucket
+        if self.context.cache:
+            # cached pages outlive short intervals and would be stored as new
+            # observations of an unchanged price, so every visit goes live
+            self.context.cache.close()
+            self.context.cache = None
+        self.load(self.store)
+        logger.info(
+            f"Tracking {len(self.items)} queries and products.",
+            extra={
+                "fields": {
+                    "demand": round(self.demand(), 1),
+                    "budget": self.budget,
+                    "stretch": round(self.stretch(), 2),
+                }
+            },
+        )
+        try:
+            await asyncio.gather(*(self.loop() for _ in range(self.concurrency)))
+        finally:
+            await self.context.close()
+
+    async def loop(self):
+        while True:
+            now = time.time()
+            if not self.heap or self.heap[0][0] > now:
+                wait = self.heap[0][0] - now if self.heap else POLL_INTERVAL
+                await asyncio.sleep(min(POLL_INTERVAL, wait))
+                continue
+            _, key = heapq.heappop(self.heap)
+            item = self.items[key]
+            try:
+                if item.kind == "query":
+                    await self.refresh_query(item)
+                else:
+                    await self.refresh_product(item)
+            except FetchError as e:
+                # already logged by request(); try again on the usual interval
+                logger.warning(
+                    "Refresh failed", extra={"fields": {"key": key, "url": str(e)}}
+                )
+            except Exception:
+                logger.exception("Refresh failed", extra={"fields": {"key": key}})
+            self.schedule(item, time.time())
+
+    async def refresh_query(self, item):
+        api = self.api(item.query)
+        pages = 0
+        found = 0
+        for page in range(1, MAX_PAGES + 1):
+            url = api.search_url(page)
+            response = await api.fetch(url)
+            pages += 1
+            if response is None:
+                raise FetchError(url)
+            cards, has_next = await api.search_results(response)
+            for card in cards:
+                if card["asin"] not in self.items:
+                    self.track(card["asin"], item.query, card["url"])
+                    found += 1
+            if not cards or not has_next:
+                break
+        self.update(item, cost=pages)
+        logger.info(
+            f"Found {found} new products.",
+            extra={"fields": {"search_term": item.query["term"], "pages": pages}},
+        )
+
+    async def refresh_product(self, item):
+        api = self.api(item.query)
+        product = await api.parse_urls(item.url)
+        # an incomplete page is not stored, so availability flips are kept here
+        available = product is not None
+        if available != item.available:
+            item.flips += 1
+            item.available = available
+        if product:
+            self.store.add(product, item.query["term"])
+            self.store.flush()
+        history = self.store.history(item.key, time.time() - SCHEDULE_WINDOW)
+        self.update(item, interval=adaptive_interval(history, item.flips))
+        logger.info(
+            "Refreshed",
+            extra={
+                "fields": {
+                    "asin": item.key,
+                    "price": product and product.get("price"),
+                    "observations": len(history),
+                    "changes": count_changes(history) + item.flips,
+                    "interval": round(item.interval),
+                }
+            },
+        )
+
+    def plan(self):
+        """(due, kind, key, interval) of every tracked item, soonest first"""
+        stretch = self.stretch()
+        return sorted(
+            (item.due, item.kind, item.key, item.interval * stretch)
+            for item in self.items.values()
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keep re-crawling a watchlist, busiest products first"
+    )
+    parser.add_argument("watchlist", help="watchlist .toml or .json file")
+    parser.add_argument(
+        "--budget", type=float, default=SCHEDULE_BUDGET, help="requests per hour"
+    )
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument(
+        "--plan", action="store_true", help="print the schedule instead of crawling"
+    )
+    args = parser.parse_args()
+
+    queries = load_watchlist(args.watchlist)
+    scheduler = Scheduler(queries, args.budget, args.concurrency)
+    if args.plan:
+        store = PriceStore()
+        scheduler.load(store)
+        store.close()
+        now = time.time()
+        print(
+            f"{scheduler.demand():.1f} requests/hour asked for, budget {args.budget:.0f}"
+        )
+        for due, kind, key, interval in scheduler.plan():
+            print(
+                f"{datetime.fromtimestamp(max(due, now)):%d/%m/%Y %H:%M:%S}  {kind:<8} "
+                f"every {interval / 3600:7.2f}h  {key}"
+            )
+    else:
+        setup_logging()
+        try:
+            asyncio.run(scheduler.run())
+        except KeyboardInterrupt:
+            pass
@@ -1,316 +1,604 @@
 import time
 import json
-from datetime import datetime
-from requests_html import AsyncHTMLSession
+import logging
 import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from throttle import (
+    AdaptiveLimiter,
+    HostRateLimiter,
+    is_blocked,
+    is_server_error,
+    backoff_delay,
+)
+from renderer import RenderPool
+from transport import make_transport, accept_encoding
+from proxies import ProxyPool
+from cache import ResponseCache, SingleFlight, normalize_url, url_class
+from report import StreamingReport, GenerateReport, remove_empty_elements
+from store import PriceStore
+from archive import Archive
+from journal import CrawlJournal
+from metrics import Metrics
+from logs import setup_logging, log_product, quiet_worker
+from extractors import (
+    parse_search_page,
+    parse_product_page,
+    is_complete,
+    ExtractionStats,
+)
 from amazon_config import (
     DIRECTORY,
     NAME,
     CURRENCY,
     FILTERS,
     BASE_URL,
+    MAX_CONCURRENCY,
+    MIN_CONCURRENCY,
+    REQUESTS_PER_SECOND,
+    BURST,
+    MAX_PAGES,
+    SEARCH_CARD_ONLY,
+    CARD_FALLBACK,
+    QUEUE_SIZE,
+    RENDER,
+    RENDER_POOL_SIZE,
+    CACHE_MODE,
+    CACHE_DIRECTORY,
+    CACHE_TTLS,
+    CACHE_MAX_BYTES,
+    ARCHIVE,
+    ARCHIVE_DIRECTORY,
+    PARSER_WORKERS,
+    REPORT_FORMAT,
+    STORE,
+    INCREMENTAL,
+    INCREMENTAL_MAX_AGE,
+    JOURNAL,
+    JOURNAL_DIRECTORY,
+    HTTP_TRANSPORT,
+    HTTP2,
+    POOL_SIZE_PER_HOST,
+    KEEPALIVE_EXPIRY,
+    PROXIES,
+    PROXY_COOLDOWN,
+    PROXY_MAX_COOLDOWN,
+    PROXY_MAX_FAILURES,
+    PROXY_MIN_SUCCESS_RATE,
+    METRICS,
+    METRICS_PORT,
 )
 
 TIMEOUT = 240
 RETRIES = 4
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:96.0) Gecko/20100101 Firefox/96.0"
+)
 
+logger = logging.getLogger("scraper_async")
 
-class GenerateReport:
-    def __init__(self, file_name, filters, base_link, currency, data):
 
-        self.data = data
-        self.file_name = file_name
-        self.filters = filters
-        self.base_link = base_link
-        self.currency = currency
+class FetchError(Exception):
+    """a page could not be downloaded, even after retries"""
 
-        report = {
-            "title": self.file_name,
-            "date": self.get_now(),
-            "product_count": len(self.data),
-            "best_item": self.get_best_item(),
-            "currency": self.currency,
-            "filters": self.filters,
-            "base_link": self.base_link,
-            "products": self.data,
-        }
-        print("Creating Report...")
-        with open(f"{DIRECTORY}/{file_name}.json", "w") as f:
-            json.dump(report, f)
-        print("Done.")
 
-    @staticmethod
-    def get_now():
-        now = datetime.now()
-        return now.strftime("%d/%m/%Y %H:%M:%S")
+def rate_bucket(host, endpoint):
+    # each egress path gets its own request budget per host
+    return host if endpoint.proxy is None else f"{host} via {endpoint.proxy}"
 
-    def get_best_item(self):
-        try:
-            return sorted(self.data, key=lambda x: x["rating"], reverse=True)[0]
-        except Exception as e:
-            print(e)
-            print("Problem with sorting items")
-            return None
+
+class CrawlContext:
+    """
+    everything a crawl shares between queries: http transport, proxy pool, limiters,
+    renderer, cache, archive, parser pool, price store, metrics and the
+    in-flight fetches and parses every query can join
+    """
+
+    def __init__(self, name=NAME, requests_per_second=REQUESTS_PER_SECOND):
+        self.name = name
+        self.transport = make_transport(
+            HTTP_TRANSPORT, POOL_SIZE_PER_HOST, TIMEOUT, HTTP2, KEEPALIVE_EXPIRY
+        )
+        self.proxies = ProxyPool(
+            PROXIES,
+            PROXY_COOLDOWN,
+            PROXY_MAX_COOLDOWN,
+            PROXY_MAX_FAILURES,
+            PROXY_MIN_SUCCESS_RATE,
+        )
+        self.limiter = AdaptiveLimiter(MAX_CONCURRENCY, MIN_CONCURRENCY)
+        self.rate_limiter = HostRateLimiter(requests_per_second, BURST)
+        self.renderer = RenderPool(RENDER_POOL_SIZE, TIMEOUT, USER_AGENT)
+        self.cache = None
+        if CACHE_MODE != "off":
+            self.cache = ResponseCache(CACHE_DIRECTORY, CACHE_TTLS, CACHE_MAX_BYTES)
+        self.archive = Archive(ARCHIVE_DIRECTORY) if ARCHIVE else None
+        self.parser_pool = None
+        if PARSER_WORKERS != 0:
+            self.parser_pool = ProcessPoolExecutor(
+                PARSER_WORKERS, initializer=quiet_worker
+            )
+        self.extraction_stats = ExtractionStats()
+        self.store = PriceStore() if STORE else None
+        # asin -> future of its product, so an ASIN found by several queries is parsed once
+        self.products = {}
+        self.fetches = SingleFlight()
+        self.parses = SingleFlight()
+        self.metrics = Metrics()
+        # optional TokenBucket every request and render draws from, so a
+        # long-running caller can hold the whole crawl to a fixed budget
+        self.budget = None
+        if METRICS_PORT:
+            self.metrics.serve(METRICS_PORT)
+
+    async def close(self):
+        await self.transport.close()
+        await self.renderer.close()
+        if self.parser_pool:
+            self.parser_pool.shutdown()
+        if self.archive:
+            self.archive.close()
+        if self.cache:
+            self.cache.close()
+        if self.store:
+            self.store.close()
+        self.save_extraction_stats()
+        for proxy, stats in self.proxies.stats().items():
+            logger.info("Proxy health", extra={"fields": {"proxy": proxy, **stats}})
+        if METRICS:
+            self.metrics.log_summary()
+            self.metrics.write(f"{DIRECTORY}/{self.name}.prom")
+        self.metrics.close()
+
+    def save_extraction_stats(self):
+        stats = self.extraction_stats.summary()
+        for field, field_stats in stats.items():
+            logger.info(
+                "Extractor hit rate",
+                extra={"fields": {"field": field, **field_stats}},
+            )
+        with open(f"{DIRECTORY}/{self.name}-extractors.json", "w") as f:
+            json.dump(stats, f)
 
 
 class AmazonAPI:
-    def __init__(self, search_term, filters, base_url, currency):
-        self.asession = AsyncHTMLSession()
+    def __init__(
+        self, search_term, filters, base_url, currency, context=None, name=None
+    ):
+        # journal and report files; a watchlist names them per price band
+        self.name = name or search_term
+        self.owns_context = context is None
+        self.context = context or CrawlContext(self.name)
+        self.transport = self.context.transport
+        self.proxies = self.context.proxies
+        self.limiter = self.context.limiter
+        self.rate_limiter = self.context.rate_limiter
+        self.renderer = self.context.renderer
+        self.cache = self.context.cache
+        self.archive = self.context.archive
+        self.parser_pool = self.context.parser_pool
+        self.extraction_stats = self.context.extraction_stats
+        self.store = self.context.store
+        self.metrics = self.context.metrics
         self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:96.0) Gecko/20100101 Firefox/96.0",
+            "User-Agent": USER_AGENT,
             "Accept": "text/html,*/*",
             "Accept-Language": "en-US,en;q=0.5",
-            "Accept-Encoding": "gzip, deflate, br",
+            "Accept-Encoding": accept_encoding(),
             "X-Requested-With": "XMLHttpRequest",
-            "Connection": "keep-alive",
             "Referer": f"https://www.amazon.com/s?k={search_term}&ref=nb_sb_noss",
         }
+        self.report = None
+        self.journal = None
         self.base_url = base_url
         self.search_term = search_term
+        self.filters = filters
         self.currency = currency
         self.price_filter = f"&rh=p_36%3A{filters['min']}00-{filters['max']}00"
 
-    async def run(self):
-        print("Strating script...")
-        print(f"Looking for {self.search_term} products...")
-        urls = await self.get_product_links()
-        if not urls:
-            print("Stopped script.")
-            return
-        print(f"Got {len(urls)} products.")
-        print("Parsing the product links...")
-        tasks = [asyncio.create_task(self.parse_urls(url)) for url in urls]
-        # print(f"Got information about {len(products)} products.")
-        result = await asyncio.gather(*tasks)
-        return result
-
-    async def get_product_links(self):  #
-        # https://www.amazon.com/s?k=ps5&rh=p_36%3A27500-65000
-        url = await self.asession.get(
-            self.base_url + self.search_term + self.price_filter,
-            headers=self.headers,
+    async def run(self, resume=False):
+        logger.info(
+            "Looking for products", extra={"fields": {"search_term": self.search_term}}
         )
-        # await url.html.arender(retries=RETRIES, timeout=TIMEOUT)
-        print(url.status_code)
-        product_asins = [
-            asin.attrs["data-asin"]
-            for asin in url.html.find("div[data-asin]")
-            if asin.attrs["data-asin"] != ""
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        results = []
+        if REPORT_FORMAT == "ndjson":
+            self.report = StreamingReport(
+                self.name,
+                self.filters,
+                self.base_url,
+                self.currency,
+                search_term=self.search_term,
+            )
+        if JOURNAL:
+            path = f"{JOURNAL_DIRECTORY}/{self.name}.journal"
+            self.journal = CrawlJournal(path, resume)
+            for product in self.journal.completed.values():
+                self.collect(product, results)
+        workers = [
+            asyncio.create_task(self.consume_product_links(queue, results))
+            for _ in range(MAX_CONCURRENCY)
         ]
-        if "B015HS4O1K" in product_asins:
-            product_asins.remove("B015HS4O1K")
-        product_link = ["https://www.amazon.com/dp/" + link for link in product_asins]
-        return product_link
-
-    async def parse_urls(self, url):
-        _asession = await self.asession.get(url, headers=self.headers)
-        # await _asession.html.arender(retries=RETRIES, timeout=TIMEOUT)
-        print(f"Getting Product:{url} --- Data")
-
-        product_asin = url.split("/")[4]
-        print("ASIN:", product_asin)
-        product_title = await self.get_title(url)
-        print(f"TITLE: {product_title} --- {url}")
-        product_price = await self.get_price(url)
-        print(f"PRICE: {product_price} --- {url}")
-        product_seller = await self.get_seller(url)
-        print(f"SELLER: {product_seller} --- {url}")
-        product_review_count = await self.get_review_count(url)
-        print(f"REVIEW_COUNT: {product_review_count} --- {url}")
-        product_rating = await self.get_rating(url)
-        print(f"RATING: {product_rating} --- {url}")
-        product_photo_url = await self.get_photo_url(url)
-        print(f"PHOTO: {product_photo_url} --- {url}")
-        if product_title and product_price and product_rating:
-            product_info = {
-                "asin": product_asin,
-                "url": url,
-                "title": product_title,
-                "price": product_price,
-                "rating": product_rating,
-                "photo_url": product_photo_url,
-                "seller": product_seller,
-                "review_count": product_review_count,
-            }
-
-            return product_info
-        return None
-
-    async def get_title(self, url):
-        _asession = await self.asession.get(url, headers=self.headers)
-        # await _asession.html.arender(retries=RETRIES, timeout=TIMEOUT)
-        title = None
-
+        total = await self.produce_product_links(queue)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
         try:
-            if _asession.html.find("span#productTitle", first=True):
-                title = _asession.html.find("span#productTitle", first=True).text
-                return title
-            elif _asession.html.find("h1.a-size-large", first=True):
-                title = _asession.html.find("h1.a-size-", first=True).text
-                return title
-            else:
-                title = ""
-
-        except Exception as e:
-            print(e)
-            print(f"Can't get a title of a product - {url}")
-            return None
-
-    async def get_seller(self, url):
-        _asession = await self.asession.get(url, headers=self.headers)
-        # await _asession.html.arender(retries=RETRIES, timeout=TIMEOUT)
-        try:
-            seller = _asession.html.find("a#bylineInfo", first=True).text
-            if "Visit the" in seller:
-                return " ".join(seller.split(" ")[2:])
-            elif "Brand" or "Brand: " in seller:
-                return "".join(seller.split(" ")[0:])
-
-        except Exception as e:
-            print(e)
+            if self.journal:
+                self.journal.finish()
+            if self.report:
+                self.report.close()
+        finally:
+            if self.owns_context:
+                await self.context.close()
+        if not total:
+            logger.warning(
+                "Stopped script.", extra={"fields": {"search_term": self.search_term}}
+            )
+            return
+        parsed = self.report.count if self.report else len(results)
+        logger.info(
+            f"Got information about {parsed} of {total} products.",
+            extra={
+                "fields": {
+                    "search_term": self.search_term,
+                    "parsed": parsed,
+                    "total": total,
+                }
+            },
+        )
+        return results
+
+    def collect(self, product, results):
+        if self.report:
+            with self.metrics.timer("report"):
+                self.report.add(product)
+        else:
+            results.append(product)
+
+    async def produce_product_links(self, queue):
+        seen = set()
+        first_page = 1
+        if self.journal:
+            seen.update(self.journal.cards)
+            pending = self.journal.pending()
+            if pending:
+                logger.info(
+                    f"Resuming {len(pending)} products.",
+                    extra={"fields": {"search_term": self.search_term}},
+                )
+            for card in pending:
+                await queue.put(card)
+            if self.journal.search_done:
+                return len(seen)
+            first_page = self.journal.last_page + 1
+        for page in range(first_page, MAX_PAGES + 1):
             try:
-                return _asession.html.find("a.qa-byline-url", first=True).text
-            except Exception as e:
-                print(f"Can't get a seller of a product - {url}")
-                return None
-
-    async def get_price(self, url):
-        price = None
-        _asession = await self.asession.get(url, headers=self.headers)
-        # await _asession.html.arender(retries=RETRIES, timeout=TIMEOUT)
-        try:
-            price_1 = _asession.html.find("span.apexPriceToPay", first=True)
-            if price_1 is not None:
-                price = float(price_1.text.split("$")[1])
-            else:
-                price = float(
-                    _asession.html.find(
-                        "span#priceblock_ourprice", first=True
-                    ).text.split("$")[1]
+                cards, has_next = await self.get_product_links(page)
+            except FetchError:
+                # already logged by request(); the page is left for a --resume run
+                break
+            new_cards = [card for card in cards if card["asin"] not in seen]
+            seen.update(card["asin"] for card in new_cards)
+            logger.info(
+                f"Page {page}: got {len(new_cards)} products.",
+                extra={"fields": {"search_term": self.search_term, "page": page}},
+            )
+            for card in new_cards:
+                if self.journal:
+                    self.journal.card(card)
+                await queue.put(card)
+            # a page of repeated (e.g. sponsored) cards still has a next page
+            last = not cards or not has_next
+            if self.journal:
+                self.journal.page(page, last)
+            if last:
+                break
+        return len(seen)
+
+    async def consume_product_links(self, queue, results):
+        while True:
+            card = await queue.get()
+            try:
+                if card is None:
+                    return
+                product = await self.parse_card(card)
+                self.metrics.inc(
+                    "products_total", result="complete" if product else "incomplete"
+                )
+                if self.store:
+                    with self.metrics.timer("store"):
+                        self.store.add(product, self.search_term)
+                if self.journal:
+                    self.journal.done(card["asin"], product)
+                self.collect(product, results)
+            except FetchError:
+                # already logged by request(); left for a --resume run
+                self.metrics.inc("products_total", result="unfetched")
+            except Exception:
+                self.metrics.inc("products_total", result="error")
+                logger.exception(
+                    "Can't parse a product", extra={"fields": {"url": card["url"]}}
                 )
-                print(price)
-        except Exception as e:
-            print(e)
+            finally:
+                queue.task_done()
+
+    async def fetch(self, url):
+        # concurrent fetches of the same page share one request
+        key = normalize_url(url)
+        kind = url_class(url)
+        if self.context.fetches.pending(key):
+            self.metrics.inc("coalesced_total", kind=kind, stage="fetch")
+        with self.metrics.timer("fetch", kind=kind):
+            return await self.context.fetches.do(key, self.fetch_page, url, kind)
+
+    async def fetch_page(self, url, kind):
+        entry = self.cache.get(url) if self.cache else None
+        if entry is not None and (
+            CACHE_MODE == "replay" or entry.is_fresh(self.cache.ttl(url))
+        ):
+            self.metrics.inc("cache_total", kind=kind, result="hit")
+            return entry.response(url)
+        if CACHE_MODE == "replay":
+            self.metrics.inc("cache_total", kind=kind, result="miss")
+            logger.info("Not in cache, skipping", extra={"fields": {"url": url}})
+            return None
+        headers = self.headers
+        if entry is not None:
+            headers = {**headers, **entry.validators()}
+        response = await self.request(url, headers, kind)
+        if response is None:
+            return None
+        if response.status_code == 304 and entry is not None:
+            self.metrics.inc("cache_total", kind=kind, result="revalidated")
+            self.cache.revalidated(entry)
+            return entry.response(url)
+        if self.cache:
+            self.metrics.inc("cache_total", kind=kind, result="miss")
+        if response.status_code != 200:
+            # an error page is no page: callers treat it as a failed fetch, so
+            # it is never journaled as a last search page or a done product
+            logger.warning(
+                "Unexpected status",
+                extra={"fields": {"url": url, "status": response.status_code}},
+            )
+            return None
+        if self.archive:
+            self.archive.add(url, response.content)
+        if self.cache:
+            self.cache.put(url, response)
+        return response
+
+    async def request(self, url, headers, kind="other"):
+        host = urlsplit(url).netloc
+        for attempt in range(RETRIES):
+            if self.context.budget:
+                await self.context.budget.acquire()
+            endpoint = self.proxies.choose()
+            bucket = rate_bucket(host, endpoint)
+            await self.limiter.acquire()
+            response = None
+            started = time.perf_counter()
             try:
-                availability = _asession.html.find(
-                    "span.a-color-price", first=True
-                ).text
-                out_of_stock = _asession.html.find(
-                    "span.a-color-price", first=True
-                ).text
-                availability_message = _asession.html.find(
-                    "span.qa-availability-message", first=True
-                ).text
-                if "In Stock." or None in availability:
-                    price = float(
-                        _asession.html.find(
-                            "span.apexPriceToPay", first=True
-                        ).text.split("$")[1]
-                    )
-                elif "Temporarily out of stock." in out_of_stock:
-                    price = 0
-                elif "Currently unavailable." in availability:
-                    price = 0
-                elif "Currently unavailable." in availability_message:
-                    price = 0
-                    print(price)
-                elif "Currently unavailable." in out_of_stock:
-                    price = 0
-                else:
-                    price = None
+                await self.rate_limiter.acquire(bucket)
+                self.metrics.observe(
+                    "rate_limit_wait_seconds", time.perf_counter() - started
+                )
+                sent = time.perf_counter()
+                response = await self.transport.get(
+                    url, headers={**headers, **endpoint.identity}, proxy=endpoint.proxy
+                )
+                latency = time.perf_counter() - sent
+                self.metrics.observe("request_seconds", latency, kind=kind)
+                self.metrics.record_response(kind, response)
             except Exception as e:
-                print(price)
-                if not price:
-                    try:
-                        price = float(
-                            _asession.html.find(
-                                "span.a-color-price:nth-child(2)", first=True
-                            ).text.split("$")[1]
-                        )
-                    except Exception as e:
-                        availability = None
-                        if _asession.html.find(
-                            "div#availability", first=True
-                        ).text.startswith("P"):
-                            availability = "N/A"
-                            print(f"Product {availability}")
-                        elif (
-                            "In Stock."
-                            in _asession.html.find("div#availability", first=True).text
-                        ):
-                            price = 0
-                        else:
-                            availability = _asession.html.find(
-                                "div#availability", first=True
-                            ).text.split("\n")[0]
-                            print(f"Product {availability}")
-
-                        return None
-        return float(price)
-
-    async def get_review_count(self, url):
-        _asession = await self.asession.get(url, headers=self.headers)
-        # await _asession.html.arender(retries=RETRIES, timeout=TIMEOUT)
+                latency = None
+                self.metrics.inc("request_errors_total", kind=kind)
+                logger.warning(
+                    "Request failed",
+                    extra={
+                        "fields": {"url": url, "proxy": endpoint.name, "error": str(e)}
+                    },
+                )
+            if response is None:
+                outcome = "error"
+            elif is_blocked(response.status_code, response.text):
+                outcome = "blocked"
+            elif is_server_error(response.status_code):
+                outcome = "server_error"
+            else:
+                outcome = "ok"
+            # a 502 from a proxy with a broken upstream is its failure too,
+            # counted as an error rather than a throttling block
+            self.proxies.record(
+                endpoint, outcome == "ok", latency, blocked=outcome == "blocked"
+            )
+            self.metrics.inc(
+                "proxy_requests_total", proxy=endpoint.name, outcome=outcome
+            )
+            await self.limiter.release(ok=outcome == "ok")
+            if outcome == "ok":
+                return response
+            self.metrics.inc("retries_total", kind=kind)
+            delay = backoff_delay(attempt)
+            status = response.status_code if response is not None else None
+            logger.warning(
+                "Retrying",
+                extra={
+                    "fields": {
+                        "url": url,
+                        "proxy": endpoint.name,
+                        "outcome": outcome,
+                        "status": status,
+                        "delay": round(delay, 1),
+                        "concurrency": int(self.limiter.limit),
+                    }
+                },
+            )
+            self.rate_limiter.pause(bucket, delay)
+        self.metrics.inc("gave_up_total", kind=kind)
+        logger.error(
+            f"Giving up after {RETRIES} attempts", extra={"fields": {"url": url}}
+        )
+        return None
 
-        try:
-            return int(
-                _asession.html.find("span#acrCustomerReviewText", first=True)
-                .text.split(" ")[0]
-                .replace(",", "")
-                .strip()
+    async def parse_page(self, parser, content, url):
+        # the same document is parsed once however many callers are waiting on it
+        key = (parser.__name__, normalize_url(url), hash(content))
+        kind = url_class(url)
+        if self.context.parses.pending(key):
+            self.metrics.inc("coalesced_total", kind=kind, stage="parse")
+        with self.metrics.timer("parse", kind=kind):
+            return await self.context.parses.do(
+                key, self.parse_document, parser, content, url
             )
-        except Exception as e:
-            print(e)
-            print(f"Can't get a review count of a product - {url}")
-            return None
 
-    async def get_rating(self, url):
-        _asession = await self.asession.get(url, headers=self.headers)
-        # await _asession.html.arender(retries=RETRIES, timeout=TIMEOUT)
+    async def parse_document(self, parser, content, url):
+        # parsing a product page takes long enough to stall every other request,
+        # so it runs in worker processes and only the records come back
+        if self.parser_pool is None:
+            return parser(content, url)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.parser_pool, parser, content, url)
+
+    async def render_if_needed(self, response, missing):
+        if CACHE_MODE == "replay":
+            # a replay never touches the network, chromium included
+            return None
+        if RENDER == "always" or (RENDER == "auto" and missing):
+            try:
+                with self.metrics.timer("render", kind=url_class(response.url)):
+                    html = await self.render(response.url)
+                return html.html
+            except Exception:
+                self.metrics.inc("render_errors_total")
+                logger.exception(
+                    "Can't render a page", extra={"fields": {"url": response.url}}
+                )
+        return None
 
+    async def render(self, url):
+        """a live chromium render, paced and routed like any other request"""
+        if self.context.budget:
+            await self.context.budget.acquire()
+        endpoint = self.proxies.choose()
+        bucket = rate_bucket(urlsplit(url).netloc, endpoint)
+        await self.limiter.acquire()
+        ok = False
         try:
-            return float(
-                _asession.html.find("span.a-icon-alt", first=True).text.split(" ")[0]
+            await self.rate_limiter.acquire(bucket)
+            started = time.perf_counter()
+            html = await self.renderer.render(url, endpoint.identity, endpoint.proxy)
+            ok = not is_blocked(200, html.html)
+            self.proxies.record(
+                endpoint, ok, time.perf_counter() - started, blocked=not ok
             )
-        except Exception as e:
-            print(e)
-            print(f"Can't get a review of a product - {url}")
-            return None
-
-    async def get_photo_url(self, url):
-        _asession = await self.asession.get(url, headers=self.headers)
-        # await _asession.html.arender(retries=RETRIES, timeout=TIMEOUT)
+            return html
+        except Exception:
+            self.proxies.record(endpoint, False)
+            raise
+        finally:
+            await self.limiter.release(ok=ok)
+
+    def search_url(self, page=1):
+        # https://www.amazon.com/s?k=ps5&rh=p_36%3A27500-65000&page=2
+        url = self.base_url + self.search_term + self.price_filter
+        if page > 1:
+            url += f"&page={page}"
+        return url
+
+    async def get_product_links(self, page=1):
+        url = self.search_url(page)
+        response = await self.fetch(url)
+        if response is None:
+            raise FetchError(url)
+        return await self.search_results(response)
+
+    async def search_results(self, url):
+        """(cards, has_next) of a downloaded search page"""
+        logger.debug(
+            "Search page", extra={"fields": {"url": url.url, "status": url.status_code}}
+        )
+        cards, has_next, missing = await self.parse_page(
+            parse_search_page, url.content, url.url
+        )
+        rendered = await self.render_if_needed(url, missing)
+        if rendered is not None:
+            cards, has_next, _ = await self.parse_page(
+                parse_search_page, rendered, url.url
+            )
+        return cards, has_next
 
+    async def parse_card(self, card):
+        product = self.context.products.get(card["asin"])
+        if product is None:
+            product = asyncio.ensure_future(self.parse_new_card(card))
+            self.context.products[card["asin"]] = product
         try:
-            return _asession.html.find("img#landingImage", first=True).attrs["src"]
-        except Exception as e:
-            print(e)
-            print(f"Can't get a photo url of a product - {url}")
-            return None
-
-
-def remove_empty_elements(d):
-    """recursively remove empty lists, empty dicts, or None elements from a dictionary"""
-
-    def empty(x):
-        return x is None or x == {} or x == []
+            return await product
+        except Exception:
+            # a failed product can be tried again later
+            if self.context.products.get(card["asin"]) is product:
+                del self.context.products[card["asin"]]
+            raise
+
+    async def parse_new_card(self, card):
+        if SEARCH_CARD_ONLY:
+            if is_complete(card):
+                return card
+            if not CARD_FALLBACK:
+                return None
+        if self.store and INCREMENTAL:
+            product = self.store.fresh_product(card, INCREMENTAL_MAX_AGE)
+            if product is not None:
+                self.metrics.inc("incremental_skips_total")
+                logger.debug(
+                    "Fetched recently, skipping", extra={"fields": {"url": card["url"]}}
+                )
+                return product
+        product = await self.parse_urls(card["url"])
+        if self.store and product:
+            self.store.mark_fetched(product, card.get("price"))
+        return product
 
-    if not isinstance(d, (dict, list)):
-        return d
-    elif isinstance(d, list):
-        return [v for v in (remove_empty_elements(v) for v in d) if not empty(v)]
-    else:
-        return {
-            k: v
-            for k, v in ((k, remove_empty_elements(v)) for k, v in d.items())
-            if not empty(v)
-        }
+    async def parse_urls(self, url):
+        started = time.perf_counter()
+        _asession = await self.fetch(url)
+        if _asession is None:
+            raise FetchError(url)
+        fetched = time.perf_counter()
+        product, missing, strategies, timings = await self.parse_page(
+            parse_product_page, _asession.content, url
+        )
+        rendered = await self.render_if_needed(_asession, missing)
+        if rendered is not None:
+            product, _, strategies, timings = await self.parse_page(
+                parse_product_page, rendered, url
+            )
+        self.extraction_stats.record(strategies)
+        self.metrics.record_extraction(strategies, timings)
+        log_product(logger, product, strategies, rendered is not None, started, fetched)
+        if is_complete(product):
+            return product
+        return None
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    am = AmazonAPI(NAME, FILTERS, BASE_URL, CURRENCY)
-    scraped_data = loop.run_until_complete(am.run())
-    data = remove_empty_elements(scraped_data)
-    print(data)
-    GenerateReport(NAME, FILTERS, BASE_URL, CURRENCY, data)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resume", action="store_true", help="pick up an interrupted crawl"
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+
+    async def main():
+        am = AmazonAPI(NAME, FILTERS, BASE_URL, CURRENCY)
+        return await am.run(resume=args.resume)
+
+    scraped_data = asyncio.run(main())
+    if REPORT_FORMAT == "json":
+        data = remove_empty_elements(scraped_data or [])
+        logger.debug("Report data", extra={"fields": {"products": data}})
+        GenerateReport(NAME, FILTERS, BASE_URL, CURRENCY, data)
@@ -0,0 +1,236 @@
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from amazon_config import STORE_PATH, STORE_BATCH_SIZE
+
+
+class PriceStore:
+    """
+    price/rating history in sqlite: one `products` row per ASIN and one
+    `observations` row per (ASIN, search term, time); writes are buffered
+    and flushed in batched transactions
+    """
+
+    def __init__(self, path=STORE_PATH, batch_size=STORE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_fetches = []
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.drop_fingerprints()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                asin TEXT PRIMARY KEY,
+                url TEXT,
+                title TEXT,
+                seller TEXT,
+                photo_url TEXT,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS observations (
+                id INTEGER PRIMARY KEY,
+                asin TEXT NOT NULL REFERENCES products (asin),
+                search_term TEXT NOT NULL,
+                observed_at REAL NOT NULL,
+                price REAL,
+                rating REAL,
+                review_count INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS observations_asin
+                ON observations (asin, observed_at);
+            CREATE INDEX IF NOT EXISTS observations_term
+                ON observations (search_term, observed_at);
+            CREATE INDEX IF NOT EXISTS observations_time
+                ON observations (observed_at);
+            CREATE TABLE IF NOT EXISTS fetch_state (
+                asin TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL,
+                card_price REAL
+            );
+            """)
+
+    def drop_fingerprints(self):
+        """
+        stores made before fetch_state lost its unused fingerprint column get
+        the table rebuilt; it only remembers fetch times, so at worst a few
+        product pages are fetched again
+        """
+        columns = [
+            row["name"] for row in self.db.execute("PRAGMA table_info(fetch_state)")
+        ]
+        if "fingerprint" in columns:
+            self.db.execute("DROP TABLE fetch_state")
+
+    def add(self, product, search_term, observed_at=None):
+        if not product:
+            return
+        self.pending.append((product, search_term, observed_at or time.time()))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def mark_fetched(self, product, card_price=None, fetched_at=None):
+        """remember that the product page of `product` was just downloaded"""
+        self.pending_fetches.append(
+            (product["asin"], fetched_at or time.time(), card_price)
+        )
+        if len(self.pending_fetches) >= self.batch_size:
+            self.flush()
+
+    def fresh_product(self, card, max_age):
+        """
+        the stored record of a search card's ASIN, refreshed with the card's
+        price, rating and review count, when its product page was fetched less
+        than `max_age` seconds ago and the card price has not moved since;
+        None means the product page has to be fetched
+        """
+        state = self.db.execute(
+            "SELECT fetched_at, card_price FROM fetch_state WHERE asin = ?",
+            (card["asin"],),
+        ).fetchone()
+        if state is None or time.time() - state["fetched_at"] > max_age:
+            return None
+        if card.get("price") != state["card_price"]:
+            return None
+        row = self.db.execute(
+            """
+            SELECT p.asin, p.url, p.title, o.price, o.rating, p.photo_url,
+                   p.seller, o.review_count
+            FROM products p
+            JOIN observations o ON o.asin = p.asin
+            WHERE p.asin = ?
+            ORDER BY o.observed_at DESC
+            LIMIT 1
+            """,
+            (card["asin"],),
+        ).fetchone()
+        if row is None:
+            return None
+        product = dict(row)
+        for field in ("price", "rating", "review_count"):
+            if card.get(field) is not None:
+                product[field] = card[field]
+        return product
+
+    def flush(self):
+        if not self.pending and not self.pending_fetches:
+            return
+        with self.db:
+            self.db.executemany(
+                """
+                INSERT INTO products
+                    (asin, url, title, seller, photo_url, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (asin) DO UPDATE SET
+                    url = COALESCE(excluded.url, url),
+                    title = COALESCE(excluded.title, title),
+                    seller = COALESCE(excluded.seller, seller),
+                    photo_url = COALESCE(excluded.photo_url, photo_url),
+                    last_seen = MAX(last_seen, excluded.last_seen)
+                """,
+                [
+                    (
+                        p["asin"],
+                        p.get("url"),
+                        p.get("title"),
+                        p.get("seller"),
+                        p.get("photo_url"),
+                        observed_at,
+                        observed_at,
+                    )
+                    for p, _, observed_at in self.pending
+                ],
+            )
+            self.db.executemany(
+                """
+                INSERT INTO observations
+                    (asin, search_term, observed_at, price, rating, review_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        p["asin"],
+                        term,
+                        observed_at,
+                        p.get("price"),
+                        p.get("rating"),
+                        p.get("review_count"),
+                    )
+                    for p, term, observed_at in self.pending
+                ],
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO fetch_state VALUES (?, ?, ?)",
+                self.pending_fetches,
+            )
+        self.pending = []
+        self.pending_fetches = []
+
+    def history(self, asin, since=None):
+        rows = self.db.execute(
+            """
+            SELECT observed_at, search_term, price, rating, review_count
+            FROM observations
+            WHERE asin = ? AND observed_at >= ?
+            ORDER BY observed_at
+            """,
+            (asin, since or 0),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest(self, search_term):
+        """most recent observation of every ASIN seen for `search_term`"""
+        rows = self.db.execute(
+            """
+            SELECT p.asin, p.url, p.title, p.seller, p.photo_url,
+                   o.price, o.rating, o.review_count, o.observed_at
+            FROM observations o
+            JOIN products p ON p.asin = o.asin
+            WHERE o.search_term = ?
+              AND o.observed_at = (
+                  SELECT MAX(observed_at) FROM observations
+                  WHERE asin = o.asin AND search_term = o.search_term
+              )
+            ORDER BY o.rating DESC
+            """,
+            (search_term,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%d/%m/%Y %H:%M:%S")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the price history store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    history_parser = commands.add_parser("history", help="observations of one ASIN")
+    history_parser.add_argument("asin")
+    history_parser.add_argument("--days", type=float, default=None)
+    latest_parser = commands.add_parser("latest", help="latest snapshot of a search")
+    latest_parser.add_argument("search_term")
+    args = parser.parse_args()
+
+    store = PriceStore()
+    if args.command == "history":
+        since = time.time() - args.days * 86400 if args.days else None
+        for row in store.history(args.asin, since):
+            print(
+                f"{format_time(row['observed_at'])}  {row['search_term']:<20} "
+                f"price={row['price']} rating={row['rating']} "
+                f"reviews={row['review_count']}"
+            )
+    else:
+        for row in store.latest(args.search_term):
+            print(
+                f"{row['asin']}  price={row['price']} rating={row['rating']} "
+                f"reviews={row['review_count']}  {format_time(row['observed_at'])}  "
+                f"{row['title']}"
+            )
+    store.close()
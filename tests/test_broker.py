@@ -0,0 +1,94 @@
+import pytest
+from distributed import SqliteBroker, query_key
+from amazon_config import MAX_ATTEMPTS
+
+
+@pytest.fixture
+def broker(tmp_path):
+    broker = SqliteBroker(str(tmp_path / "queue.db"))
+    yield broker
+    broker.close()
+
+
+def query(low, high):
+    return {"term": "ps5", "filters": {"min": low, "max": high}, "currency": "$"}
+
+
+def test_put_deduplicates_by_key(broker):
+    assert broker.put("search", "a", {"page": 1})
+    assert not broker.put("search", "a", {"page": 2})
+    assert broker.counts() == {"search/pending": 1}
+
+
+def test_lease_ack(broker):
+    broker.put("search", "a", {"page": 1})
+    task = broker.lease("w1")
+    assert task.key == "a" and task.payload == {"page": 1} and task.attempts == 1
+    assert broker.lease("w2") is None
+    broker.ack(task, "w1")
+    assert broker.counts() == {"search/done": 1}
+    assert broker.idle()
+
+
+def test_lease_by_priority(broker):
+    broker.put("search", "later", {}, priority=1)
+    broker.put("product", "first", {})
+    assert broker.lease("w").key == "first"
+
+
+def test_ack_of_another_worker_is_ignored(broker):
+    broker.put("search", "a", {})
+    task = broker.lease("w1", seconds=-1)
+    broker.lease("w2")
+    broker.ack(task, "w1")
+    assert broker.counts() == {"search/leased": 1}
+
+
+def test_nack_retries_then_fails(broker):
+    broker.put("search", "a", {})
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        task = broker.lease("w")
+        assert task.attempts == attempt
+        broker.nack(task, "w", "boom", delay=0)
+    assert broker.lease("w") is None
+    assert broker.counts() == {"search/failed": 1}
+    assert broker.idle()
+
+
+def test_nack_delay_hides_task(broker):
+    broker.put("search", "a", {})
+    broker.nack(broker.lease("w"), "w", "boom", delay=60)
+    assert broker.lease("w") is None
+    assert not broker.idle()
+
+
+def test_expired_lease_is_taken_over(broker):
+    broker.put("search", "a", {})
+    assert broker.lease("crashed", seconds=-1) is not None
+    task = broker.lease("w2")
+    assert task.key == "a" and task.attempts == 2
+
+
+def test_expired_leases_fail_after_max_attempts(broker):
+    broker.put("search", "a", {})
+    for _ in range(MAX_ATTEMPTS):
+        assert broker.lease("crashed", seconds=-1) is not None
+    assert broker.lease("w") is None
+    assert broker.counts() == {"search/failed": 1}
+    assert broker.idle()
+
+
+def test_results_are_kept_per_query(broker):
+    low, high = query_key(query(100, 200)), query_key(query(300, 400))
+    broker.add_result(low, "B1", {"asin": "B1", "price": 150.0}, "w")
+    broker.add_result(high, "B2", {"asin": "B2", "price": 350.0}, "w")
+    broker.add_result(low, "B1", {"asin": "B1", "price": 140.0}, "w")
+    assert broker.results(low) == [{"asin": "B1", "price": 140.0}]
+    assert broker.results(high) == [{"asin": "B2", "price": 350.0}]
+
+
+def test_reset(broker):
+    broker.put("search", "a", {})
+    broker.add_result("k", "B1", {}, "w")
+    broker.reset()
+    assert broker.counts() == {} and broker.results("k") == []
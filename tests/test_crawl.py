@@ -0,0 +1,70 @@
+import os
+import sys
+import asyncio
+import pytest
+import extractors
+import scraper_async
+from journal import CrawlJournal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "bench"))
+from mock_server import MockAmazon  # noqa: E402
+
+PRODUCTS = 45
+FILTERS = {"min": "1", "max": "2"}
+
+
+@pytest.fixture
+def mock(tmp_path, monkeypatch):
+    mock = MockAmazon(products=PRODUCTS, cards_per_page=10, padding=2000, seed=0)
+    port = mock.start()
+    (tmp_path / "reports").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(extractors, "PRODUCT_URL", f"http://127.0.0.1:{port}/dp/")
+    monkeypatch.setattr(scraper_async, "PARSER_WORKERS", 0)
+    monkeypatch.setattr(scraper_async, "RENDER", "never")
+    monkeypatch.setattr(
+        scraper_async.CrawlContext.__init__, "__defaults__", (scraper_async.NAME, 1000)
+    )
+    monkeypatch.setattr(scraper_async, "BURST", 1000)
+    monkeypatch.setattr(scraper_async, "METRICS", False)
+    monkeypatch.setattr(scraper_async, "backoff_delay", lambda attempt: 0.0)
+    mock.base_url = f"http://127.0.0.1:{port}/s?k="
+    yield mock
+    mock.stop()
+
+
+def crawl(mock, resume=False):
+    async def run():
+        api = scraper_async.AmazonAPI("ps5", FILTERS, mock.base_url, "$")
+        return await api.run(resume=resume), api
+
+    products, api = asyncio.run(run())
+    return [product for product in products or [] if product], api.journal
+
+
+def test_server_errors_are_left_for_resume(mock):
+    mock.error_rate = 0.6
+    products, journal = crawl(mock)
+    assert all(product["price"] for product in products)
+    replayed = CrawlJournal(journal.path, resume=True)
+    replayed.handle.close()
+    assert os.path.exists(journal.path)
+    # no error page was taken for a finished product or the last search page
+    assert not any(product is None for product in replayed.completed.values())
+    assert len(products) + len(replayed.pending()) == len(replayed.cards)
+    assert replayed.search_done == (len(replayed.cards) == PRODUCTS)
+
+    mock.error_rate = 0.0
+    products, journal = crawl(mock, resume=True)
+    assert len(products) == PRODUCTS
+    assert not os.path.exists(journal.path)
+
+
+def test_failed_first_page_keeps_journal(mock):
+    mock.error_rate = 1.0
+    products, journal = crawl(mock)
+    assert products == []
+    assert os.path.exists(journal.path)
+    replayed = CrawlJournal(journal.path, resume=True)
+    replayed.handle.close()
+    assert not replayed.search_done
@@ -0,0 +1,122 @@
+import os
+import sys
+import pytest
+import parsers
+from extractors import (
+    PRODUCT_FIELDS,
+    FieldExtractor,
+    PageQuery,
+    parse_product_page,
+    parse_search_page,
+)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "bench"))
+from mock_server import MockAmazon  # noqa: E402
+
+URL = "https://www.amazon.com/dp/B000000001"
+APEX = '<span class="apexPriceToPay"><span class="a-offscreen">$10.00</span></span>'
+COLOR_PRICE = '<div><span>Price:</span><span class="a-color-price">$5.00</span></div>'
+TITLE = '<span id="productTitle"> Console </span>'
+H1_TITLE = '<h1 class="a-size-large">Console (Renewed)</h1>'
+BYLINE = '<a id="bylineInfo">Visit the Sony Store</a>'
+QA_BYLINE = '<a class="qa-byline-url">Sony Interactive</a>'
+
+
+def page(*parts):
+    html = "<html><body>" + "".join(parts) + "</body></html>"
+    return PageQuery(parsers.parse_document(html, URL))
+
+
+def extractor(field, **overrides):
+    """a fresh copy of a product field's extractor, without its hit counts"""
+    original = next(e for e in PRODUCT_FIELDS if e.field == field)
+    options = {"reorder": original.reorder, "reorder_every": original.reorder_every}
+    return FieldExtractor(field, original.strategies, **{**options, **overrides})
+
+
+def test_apex_price_wins_after_fallbacks_collected_more_hits():
+    price = extractor("price", reorder_every=5)
+    for _ in range(20):
+        assert price.extract(page(COLOR_PRICE)) == (5.0, "color_price")
+    assert price.extract(page(COLOR_PRICE, APEX)) == (10.0, "apex")
+
+
+def test_unavailable_is_the_last_resort():
+    price = extractor("price")
+    message = '<div id="availability">Currently unavailable.</div>'
+    assert price.extract(page(message)) == (0.0, "availability")
+    assert price.extract(page(message, APEX)) == (10.0, "apex")
+
+
+def test_title_precedence():
+    title = extractor("title")
+    assert title.extract(page(H1_TITLE, TITLE)) == ("Console", "product_title")
+    assert title.extract(page(H1_TITLE)) == ("Console (Renewed)", "h1_large")
+
+
+def test_seller_precedence():
+    seller = extractor("seller")
+    assert seller.extract(page(QA_BYLINE, BYLINE)) == ("Sony Store", "byline")
+    assert seller.extract(page(QA_BYLINE)) == ("Sony Interactive", "qa_byline")
+
+
+def test_equivalent_strategies_are_reordered_by_hits():
+    title = extractor("title", reorder_every=5)
+    for _ in range(5):
+        title.extract(page(H1_TITLE))
+    assert title.strategies[0].name == "h1_large"
+
+
+class CountingDocument:
+    def __init__(self, html):
+        self.html = html
+        self.calls = {}
+
+    def find(self, selector, first=False):
+        self.calls[selector] = self.calls.get(selector, 0) + 1
+        return self.html.find(selector, first=first)
+
+
+def test_page_query_runs_each_selector_once():
+    document = CountingDocument(
+        parsers.parse_document(f"<html><body>{TITLE}{APEX}</body></html>", URL)
+    )
+    query = PageQuery(document)
+    for _ in range(3):
+        assert query.find("span#productTitle").text == "Console"
+        assert query.find("span#missing") is None
+    assert document.calls == {"span#productTitle": 1, "span#missing": 1}
+
+
+@pytest.fixture(scope="module")
+def mock():
+    return MockAmazon(products=20, cards_per_page=10, padding=2000)
+
+
+def backends():
+    return [backend for backend in parsers.BACKENDS if parsers.available(backend)]
+
+
+@pytest.mark.parametrize("backend", backends())
+def test_backend_parity_on_product_page(monkeypatch, mock, backend):
+    content = mock.product_page("B000000001")
+    monkeypatch.setattr(parsers.parse_document, "__defaults__", ("requests_html",))
+    expected, _, strategies, _ = parse_product_page(content, URL)
+    monkeypatch.setattr(parsers.parse_document, "__defaults__", (backend,))
+    product, render, backend_strategies, _ = parse_product_page(content, URL)
+    assert product == expected
+    assert backend_strategies == strategies
+    assert not render
+    assert product["price"] == float(MockAmazon.product("B000000001")["price"])
+
+
+@pytest.mark.parametrize("backend", backends())
+def test_backend_parity_on_search_page(monkeypatch, mock, backend):
+    content = mock.search_page("ps5", 1)
+    url = "https://www.amazon.com/s?k=ps5"
+    monkeypatch.setattr(parsers.parse_document, "__defaults__", ("requests_html",))
+    expected = parse_search_page(content, url)
+    monkeypatch.setattr(parsers.parse_document, "__defaults__", (backend,))
+    cards, has_next, render = parse_search_page(content, url)
+    assert (cards, has_next, render) == expected
+    assert len(cards) == 10 and has_next
@@ -0,0 +1,86 @@
+import os
+import pytest
+from journal import CrawlJournal
+
+
+def card(asin):
+    return {"asin": asin, "url": f"https://www.amazon.com/dp/{asin}", "price": 10.0}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal" / "ps5_1-2.journal")
+
+
+def reopen(path):
+    journal = CrawlJournal(path, resume=True)
+    journal.handle.close()
+    return journal
+
+
+def test_replay(path):
+    journal = CrawlJournal(path)
+    journal.card(card("A"))
+    journal.card(card("B"))
+    journal.page(1, last=False)
+    journal.done("A", {"asin": "A"})
+    journal.handle.close()
+
+    replayed = reopen(path)
+    assert list(replayed.cards) == ["A", "B"]
+    assert replayed.completed == {"A": {"asin": "A"}}
+    assert replayed.last_page == 1 and not replayed.search_done
+    assert replayed.pending() == [card("B")]
+
+
+def test_truncated_line_is_skipped(path):
+    journal = CrawlJournal(path)
+    journal.card(card("A"))
+    journal.handle.close()
+    with open(path, "a") as f:
+        f.write('{"type": "card", "card": {"asin": "B"')
+
+    resumed = CrawlJournal(path, resume=True)
+    assert list(resumed.cards) == ["A"]
+    # the cut line is terminated, so new events replay cleanly
+    resumed.done("A", {"asin": "A"})
+    resumed.handle.close()
+    assert reopen(path).completed == {"A": {"asin": "A"}}
+
+
+def test_fresh_run_starts_over(path):
+    journal = CrawlJournal(path)
+    journal.card(card("A"))
+    journal.handle.close()
+    CrawlJournal(path).handle.close()
+    assert reopen(path).cards == {}
+
+
+def test_finish_removes_completed_journal(path):
+    journal = CrawlJournal(path)
+    journal.card(card("A"))
+    journal.page(1, last=True)
+    journal.done("A", None)
+    journal.finish()
+    assert not os.path.exists(path)
+
+
+def test_finish_keeps_journal_with_pending_products(path):
+    journal = CrawlJournal(path)
+    journal.card(card("A"))
+    journal.card(card("B"))
+    journal.page(1, last=True)
+    journal.done("A", {"asin": "A"})
+    journal.finish()
+    assert os.path.exists(path)
+    assert reopen(path).pending() == [card("B")]
+
+
+def test_finish_keeps_journal_of_unfinished_search(path):
+    journal = CrawlJournal(path)
+    journal.card(card("A"))
+    journal.page(1, last=False)
+    journal.done("A", {"asin": "A"})
+    journal.finish()
+    assert os.path.exists(path)
+    assert reopen(path).last_page == 1
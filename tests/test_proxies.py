@@ -0,0 +1,40 @@
+from proxies import ProxyPool
+
+GOOD, BAD = "http://good:8080", "http://bad:8080"
+
+
+def pool():
+    return ProxyPool([GOOD, BAD], cooldown=30, max_cooldown=300)
+
+
+def endpoint(pool, proxy):
+    return next(e for e in pool.endpoints if e.proxy == proxy)
+
+
+def test_server_errors_count_against_a_proxy():
+    proxies = pool()
+    bad = endpoint(proxies, BAD)
+    for _ in range(3):
+        proxies.record(bad, False, 0.1, blocked=False)
+    assert bad.errors == 3 and bad.blocks == 0
+    assert bad.strikes == 1
+    assert all(proxies.choose().proxy == GOOD for _ in range(20))
+
+
+def test_a_stray_block_does_not_quarantine():
+    proxies = pool()
+    good = endpoint(proxies, GOOD)
+    proxies.record(good, False, 0.1, blocked=True)
+    proxies.record(good, True, 0.1)
+    assert good.blocks == 1 and good.strikes == 0
+    assert good.healthy(0) and good.quarantined_until == 0.0
+
+
+def test_all_quarantined_routes_to_least_bad():
+    proxies = pool()
+    good, bad = endpoint(proxies, GOOD), endpoint(proxies, BAD)
+    for _ in range(3):
+        proxies.record(good, False, 0.1, blocked=True)
+    for _ in range(5):
+        proxies.record(bad, False, 0.1)
+    assert proxies.choose() is good
@@ -0,0 +1,120 @@
+import time
+import random
+import asyncio
+
+BLOCKED_STATUS_CODES = (403, 429, 503)
+CAPTCHA_MARKERS = ("/errors/validateCaptcha", "Enter the characters you see below")
+
+
+def is_blocked(status_code, text):
+    """true when amazon answered with a throttling status or a captcha page"""
+    if status_code in BLOCKED_STATUS_CODES:
+        return True
+    return any(marker in text for marker in CAPTCHA_MARKERS)
+
+
+def is_server_error(status_code):
+    """a 5xx from amazon or a proxy, or a proxy refusing our credentials; worth a retry"""
+    return status_code >= 500 or status_code == 407
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class TokenBucket:
+    """token bucket that paces requests to `rate` per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class HostRateLimiter:
+    """one token bucket per host"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+
+    def bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.capacity)
+        return self.buckets[host]
+
+    async def acquire(self, host):
+        await self.bucket(host).acquire()
+
+    def pause(self, host, seconds):
+        self.bucket(host).pause(seconds)
+
+
+class AdaptiveLimiter:
+    """
+    concurrency limiter tuned with AIMD: every success grows the limit by
+    roughly one slot per window, every block halves it (at most once per cooldown)
+    """
+
+    def __init__(
+        self,
+        max_concurrency,
+        min_concurrency=1,
+        initial=None,
+        decrease_factor=0.5,
+        cooldown=5.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(initial or max_concurrency)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, ok=True):
+        async with self._condition:
+            self.in_flight -= 1
+            if ok:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(
+                        self.min_concurrency, self.limit * self.decrease_factor
+                    )
+                    self.last_decrease = now
+            self._condition.notify_all()
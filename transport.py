@@ -0,0 +1,111 @@
+import asyncio
+from urllib.parse import urlsplit
+from requests_html import AsyncHTMLSession
+from cache import CachedResponse
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+
+def accept_encoding():
+    """only advertise the encodings we can actually decode"""
+    encodings = ["gzip", "deflate"]
+    if brotli is not None:
+        encodings.append("br")
+    return ", ".join(encodings)
+
+
+def available():
+    return httpx is not None
+
+
+class HttpTransport:
+    """
+    one async http client per egress path (direct or a proxy) for every
+    query of a process: keep-alive connections, http/2 multiplexing when h2
+    is installed, gzip/brotli decoding, and at most `per_host` requests in
+    flight to any one host
+    """
+
+    def __init__(self, per_host, timeout, http2=True, keepalive_expiry=30):
+        self.http2 = http2 and h2 is not None
+        self.per_host = per_host
+        self.timeout = timeout
+        self.keepalive_expiry = keepalive_expiry
+        self.hosts = {}
+        self.clients = {}
+
+    def client(self, proxy=None):
+        if proxy not in self.clients:
+            self.clients[proxy] = httpx.AsyncClient(
+                http2=self.http2,
+                proxy=proxy,
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=None,
+                    max_keepalive_connections=self.per_host * 4,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+        return self.clients[proxy]
+
+    def slots(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = asyncio.Semaphore(self.per_host)
+        return self.hosts[host]
+
+    async def get(self, url, headers=None, proxy=None):
+        async with self.slots(urlsplit(url).netloc):
+            response = await self.client(proxy).get(url, headers=headers)
+        return CachedResponse(
+            str(response.url),
+            response.status_code,
+            response.content,
+            response.headers,
+            from_cache=False,
+        )
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+
+class SessionTransport:
+    """
+    the requests_html fallback when httpx is not installed; requests are
+    blocking, so parallelism is capped by the session's `workers` threads
+    """
+
+    http2 = False
+
+    def __init__(self, workers):
+        self.session = AsyncHTMLSession(workers=workers)
+
+    async def get(self, url, headers=None, proxy=None):
+        proxies = {"http": proxy, "https": proxy} if proxy else None
+        return await self.session.get(url, headers=headers, proxies=proxies)
+
+    async def close(self):
+        await self.session.close()
+
+
+def make_transport(kind, per_host, timeout, http2=True, keepalive_expiry=30):
+    if kind == "httpx" and available():
+        return HttpTransport(per_host, timeout, http2, keepalive_expiry)
+    return SessionTransport(per_host)